@@ -0,0 +1,113 @@
+import os
+from urllib.parse import urlsplit, parse_qsl
+from dotenv import load_dotenv
+
+import client
+import metrics
+from cache import ResponseCache
+from replay import Recorder
+
+load_dotenv()
+
+API_URL = os.getenv('API_URL', 'https://ruimte.omgevingswet.overheid.nl/ruimtelijke-plannen/api/opvragen/v4')
+
+# the largest pageSize the API accepts
+MAX_PAGE_SIZE = 100
+
+_cache = None
+_offline = False
+_recorder = None
+
+
+class OfflineCacheMiss(LookupError):
+  """Raised in offline mode when a response is not in the cache."""
+
+
+def configure(cache_path="./cache/responses.sqlite", ttl_days: float = 30, max_mb: float = 512, offline: bool = False, record: str = None):
+  """
+  Sets up the response cache. Pass cache_path=None to disable caching.
+  In offline mode every request is answered from the cache (expired
+  entries included) and a miss raises OfflineCacheMiss. With `record` every
+  response is also written to that directory as a replay fixture.
+  """
+  global _cache, _offline, _recorder
+  _recorder = Recorder(record) if record else None
+  _cache = ResponseCache(cache_path, ttl=ttl_days * 24 * 3600, max_bytes=int(max_mb * 1024 * 1024)) if cache_path else None
+  _offline = offline
+  if offline and _cache is None:
+    raise ValueError("offline mode needs a cache")
+
+
+def get_json(method: str, endpoint: str, params=None, headers=None, json=None, name: str = None, ttl: float = None):
+  """
+  Performs a request against the Ruimtelijke Plannen API and returns the
+  decoded JSON body, answering from the response cache when possible.
+  `name` labels the request in the metrics (defaults to the endpoint) and
+  `ttl` (seconds) overrides the cache's ttl for this request.
+  """
+  name = name or endpoint
+  key = ResponseCache.key(endpoint, params, json) if _cache else None
+  if _cache:
+    cached = _cache.get(key, stale=_offline, ttl=ttl)
+    if cached is not None:
+      metrics.count("cache_hits")
+      if _recorder:
+        _recorder.record(method, endpoint, params, json, cached)
+      return cached
+    metrics.count("cache_misses")
+  if _offline:
+    raise OfflineCacheMiss(f"{method} {endpoint} is not cached")
+
+  response = client.request(method, f"{API_URL}{endpoint}", name=name, params=params, headers=headers, json=json)
+  metrics.count("payload_bytes", len(response.content))
+  response.raise_for_status()
+  result = response.json()
+  if _cache:
+    _cache.set(key, result)
+  if _recorder:
+    _recorder.record(method, endpoint, params, json, result)
+  return result
+
+
+def cache_stats() -> dict:
+  if _cache is None:
+    return {}
+  return _cache.stats()
+
+
+class Pages:
+  """
+  Lazily iterates over the items of a paginated (HAL) API response.
+
+  Pages are requested one at a time with the largest page size the API
+  allows, following `_links.next` until the last page. `pages` and `items`
+  count what has been fetched so far.
+  """
+
+  def __init__(self, method: str, endpoint: str, embedded: str, params=None, headers=None, json=None, page_size: int = MAX_PAGE_SIZE, name: str = None, ttl: float = None):
+    self.method = method
+    self.name = name
+    self.ttl = ttl
+    self.endpoint = endpoint
+    self.embedded = embedded
+    self.params = dict(params or {}, page='1', pageSize=str(page_size))
+    self.headers = headers
+    self.json = json
+    self.pages = 0
+    self.items = 0
+
+  def __iter__(self):
+    params = self.params
+    while params is not None:
+      result = get_json(self.method, self.endpoint, params=params, headers=self.headers, json=self.json, name=self.name, ttl=self.ttl)
+      self.pages += 1
+      items = result.get("_embedded", {}).get(self.embedded, [])
+      self.items += len(items)
+      yield from items
+
+      next_link = result.get("_links", {}).get("next")
+      if next_link is None or not items:
+        params = None
+      else:
+        # keep our own endpoint and filters, take the paging from the link
+        params = dict(params, **dict(parse_qsl(urlsplit(next_link["href"]).query)))
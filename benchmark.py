@@ -0,0 +1,183 @@
+import argparse
+import json
+import os
+import tempfile
+import time
+import warnings
+warnings.filterwarnings("ignore")
+
+import numpy as np
+import pandas as pd
+
+import plannen
+import stations
+import vlakken
+import writers
+
+SCALES = {"small": 100, "medium": 10_000, "large": 1_000_000}
+
+
+def synthetic_rings(n: int, vertices: int = 8, seed: int = 0) -> list:
+  """
+  Generates `n` random star-shaped polygons (closed exterior rings in
+  lon/lat, as (vertices + 1, 2) arrays) spread over the Netherlands.
+  """
+  rng = np.random.default_rng(seed)
+  centers = np.column_stack([rng.uniform(3.5, 7.0, n), rng.uniform(50.8, 53.4, n)])
+  angles = np.sort(rng.uniform(0, 2 * np.pi, (n, vertices)), axis=1)
+  radii = rng.uniform(0.0005, 0.005, (n, vertices))
+  rings = np.stack([np.cos(angles) * radii, np.sin(angles) * radii], axis=-1) + centers[:, None, :]
+  rings = np.concatenate([rings, rings[:, :1]], axis=1)
+  return list(rings)
+
+
+def synthetic_stations_csv(n: int, filename: str, seed: int = 0):
+  """Writes `n` random stations in the beschikbare_capaciteit CSV format."""
+  rng = np.random.default_rng(seed)
+  lat, lon = rng.uniform(50.8, 53.4, n), rng.uniform(3.5, 7.0, n)
+  pd.DataFrame({
+    "station": [f"Station {i}" for i in range(n)],
+    "netbeheerder": rng.choice(["Enexis", "Liander", "Stedin"], n),
+    "beschikbare_capaciteit_invoeding_huidig_mva": rng.integers(0, 50, n).astype(float),
+    "beschikbare_capaciteit_afname_huidig_mva": rng.integers(0, 50, n).astype(float),
+    "geometry": [f"({a} {b})" for a, b in zip(lat, lon)],
+    "zip_code": [f"{rng.integers(1000, 9999)} AB" for _ in range(n)],
+  }).to_csv(filename)
+
+
+def synthetic_plans(n: int, seed: int = 0) -> list:
+  """`n` plannen, about half of them duplicates of another one."""
+  rng = np.random.default_rng(seed)
+  return [plannen.Plan(id=f"NL.IMRO.{i}", naam=f"plan {i}", parapluplan=False) for i in rng.integers(0, max(n // 2, 1), n)]
+
+
+def timeit(func, *args, repeat: int = 3) -> float:
+  """Returns the best wall time of `repeat` calls to func(*args)."""
+  best = float("inf")
+  for _ in range(repeat):
+    start = time.perf_counter()
+    func(*args)
+    best = min(best, time.perf_counter() - start)
+  return best
+
+
+def bench_area(n: int, repeat: int, reference: bool) -> dict:
+  rings = synthetic_rings(n)
+  result = {"batch": timeit(vlakken.calc_area_and_centroid_batch, rings, repeat=repeat)}
+  pool = vlakken.process_pool(os.cpu_count())
+  if pool is not None:
+    with pool:
+      pool.submit(int).result()  # start the workers before timing
+      result[f"process_pool_{os.cpu_count()}"] = timeit(vlakken.calc_area_and_centroid_batch, rings, pool, os.cpu_count(), repeat=repeat)
+      assert np.allclose(vlakken.calc_area_and_centroid_batch(rings, pool, os.cpu_count()), vlakken.calc_area_and_centroid_batch(rings), equal_nan=True)
+  if reference:
+    def per_polygon():
+      return [vlakken.calc_area_and_centoid(ring) for ring in rings]
+    result["per_polygon"] = timeit(per_polygon, repeat=repeat)
+
+    # both versions should agree
+    areas, centers_x, centers_y = vlakken.calc_area_and_centroid_batch(rings)
+    expected = per_polygon()
+    assert np.allclose(areas, [area for area, _ in expected])
+    assert np.allclose(centers_x, [center.x for _, center in expected])
+    assert np.allclose(centers_y, [center.y for _, center in expected])
+  return result
+
+
+def bench_distance(n: int, repeat: int, reference: bool) -> dict:
+  rng = np.random.default_rng(0)
+  lon1, lon2 = rng.uniform(3.5, 7.0, (2, n))
+  lat1, lat2 = rng.uniform(50.8, 53.4, (2, n))
+  result = {"batch": timeit(vlakken.calc_distance_batch, lon1, lat1, lon2, lat2, repeat=repeat)}
+  if reference:
+    def scalar():
+      return [vlakken.calc_distance(*pair) for pair in zip(lon1, lat1, lon2, lat2)]
+    result["scalar"] = timeit(scalar, repeat=repeat)
+    assert np.allclose(vlakken.calc_distance_batch(lon1, lat1, lon2, lat2), scalar(), rtol=1e-9, atol=1e-6)
+  return result
+
+
+def bench_generate_points(n: int, repeat: int, reference: bool) -> dict:
+  with tempfile.TemporaryDirectory() as tmp:
+    stations_csv = os.path.join(tmp, "stations.csv")
+    synthetic_stations_csv(n, stations_csv)
+    table = stations.load_stations(stations_csv)
+  return {"generate_points": timeit(stations.generate_points, table, repeat=repeat)}
+
+
+def bench_filter_unique_plans(n: int, repeat: int, reference: bool) -> dict:
+  plans = synthetic_plans(n)
+  result = {"filter_unique_plans": timeit(plannen.filter_unique_plans, plans, repeat=repeat)}
+  if reference:
+    def quadratic():
+      unique_plans = []
+      for plan in plans:
+        if plan not in unique_plans:
+          unique_plans.append(plan)
+      return unique_plans
+    result["quadratic"] = timeit(quadratic, repeat=repeat)
+    assert quadratic() == plannen.filter_unique_plans(plans)
+  return result
+
+
+def bench_csv(n: int, repeat: int, reference: bool) -> dict:
+  with tempfile.TemporaryDirectory() as tmp:
+    stations_csv = os.path.join(tmp, "stations.csv")
+    synthetic_stations_csv(n, stations_csv)
+    rows = {column: np.random.default_rng(0).uniform(0, 1000, n) for column in ["station_lat", "station_long", "center_vlak_lat", "center_vlak_long", "area_vlak", "distance_to_station"]}
+    rows["name"] = ["Station"] * n
+    rows["zip_code"] = ["1234 AB"] * n
+
+    def write():
+      writer = writers.RowWriter(os.path.join(tmp, "station_data.csv"), list(rows))
+      for start in range(0, n, 100):
+        writer.write({column: values[start:start + 100] for column, values in rows.items()})
+        writer.station_done()
+      writer.close()
+
+    return {
+      "load_stations": timeit(stations.load_stations, stations_csv, repeat=repeat),
+      "write_rows": timeit(write, repeat=repeat),
+    }
+
+
+BENCHMARKS = {
+  "calc_area_and_centoid": bench_area,
+  "calc_distance": bench_distance,
+  "generate_points": bench_generate_points,
+  "filter_unique_plans": bench_filter_unique_plans,
+  "csv": bench_csv,
+}
+
+
+if __name__ == "__main__":
+  parser = argparse.ArgumentParser(description='Benchmarks for the geometry, distance and CSV hot paths, on synthetic data')
+  parser.add_argument('--scale', nargs='+', default=["small", "medium"], choices=sorted(SCALES), dest="scales")
+  parser.add_argument('--only', nargs='+', default=sorted(BENCHMARKS), choices=sorted(BENCHMARKS), dest="only")
+  parser.add_argument('--repeat', type=int, default=3, dest="repeat")
+  parser.add_argument('--reference-limit', type=int, default=1000, dest="reference_limit", help="largest n to also time the old per-item implementations at")
+  parser.add_argument('--json', dest="json", help="write the results to this file")
+  parser.add_argument('--compare', dest="compare", help="a previous --json file to compare against")
+  args = parser.parse_args()
+
+  previous = {}
+  if args.compare:
+    with open(args.compare) as f:
+      previous = json.load(f)
+
+  results = {}
+  for scale in args.scales:
+    n = SCALES[scale]
+    for name in args.only:
+      timings = BENCHMARKS[name](n, args.repeat, n <= args.reference_limit)
+      for variant, seconds in timings.items():
+        key = f"{name}.{variant}[{n}]"
+        results[key] = seconds
+        line = f"{key:<50} {seconds:10.4f}s {seconds / n * 1e6:10.3f}us/item"
+        if key in previous:
+          line += f"  ({previous[key] / seconds:.2f}x vs previous)"
+        print(line)
+
+  if args.json:
+    with open(args.json, "w") as f:
+      json.dump(results, f, indent=2)
@@ -0,0 +1,90 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+import zlib
+
+
+class ResponseCache:
+  """
+  Content-addressed on-disk cache for API responses.
+
+  Responses are stored zlib-compressed in a SQLite database, keyed on a hash
+  of the endpoint, query parameters and request body. Entries expire after
+  `ttl` seconds and the least recently used entries are evicted once the
+  cache grows beyond `max_bytes`.
+  """
+
+  def __init__(self, path: str, ttl: float = 30 * 24 * 3600, max_bytes: int = 512 * 1024 * 1024):
+    if os.path.dirname(path):
+      os.makedirs(os.path.dirname(path), exist_ok=True)
+    self.ttl = ttl
+    self.max_bytes = max_bytes
+    self.hits = 0
+    self.misses = 0
+    self._lock = threading.Lock()
+    self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+    self._db.execute("""
+      CREATE TABLE IF NOT EXISTS responses (
+        key TEXT PRIMARY KEY,
+        body BLOB NOT NULL,
+        size INTEGER NOT NULL,
+        stored_at REAL NOT NULL,
+        accessed_at REAL NOT NULL
+      )""")
+    self._db.execute("CREATE INDEX IF NOT EXISTS responses_accessed_at ON responses (accessed_at)")
+    self._size = self._db.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+
+  @staticmethod
+  def key(endpoint: str, params=None, body=None) -> str:
+    payload = json.dumps([endpoint, params or {}, body], sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+  def get(self, key: str, stale: bool = False, ttl: float = None):
+    """
+    Returns the cached response for `key`, or None when it is missing or
+    expired. `ttl` overrides the cache's ttl for this lookup. With
+    `stale=True` expired entries are returned as well.
+    """
+    now = time.time()
+    ttl = self.ttl if ttl is None else ttl
+    with self._lock:
+      row = self._db.execute("SELECT body, stored_at FROM responses WHERE key = ?", (key,)).fetchone()
+      if row is None or (not stale and now - row[1] > ttl):
+        self.misses += 1
+        return None
+      self._db.execute("UPDATE responses SET accessed_at = ? WHERE key = ?", (now, key))
+      self.hits += 1
+    return json.loads(zlib.decompress(row[0]))
+
+  def set(self, key: str, value) -> None:
+    body = zlib.compress(json.dumps(value, separators=(",", ":")).encode())
+    now = time.time()
+    with self._lock:
+      old = self._db.execute("SELECT size FROM responses WHERE key = ?", (key,)).fetchone()
+      self._db.execute("INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?)", (key, body, len(body), now, now))
+      self._size += len(body) - (old[0] if old else 0)
+      if self._size > self.max_bytes:
+        self._evict()
+
+  def _evict(self) -> None:
+    # remove least recently used entries until we're back under 90% of the limit
+    target = self.max_bytes * 0.9
+    rows = self._db.execute("SELECT key, size FROM responses ORDER BY accessed_at").fetchall()
+    removed = []
+    for key, size in rows:
+      if self._size <= target:
+        break
+      removed.append((key,))
+      self._size -= size
+    self._db.executemany("DELETE FROM responses WHERE key = ?", removed)
+
+  def stats(self) -> dict:
+    return {"hits": self.hits, "misses": self.misses, "bytes": self._size}
+
+  def clear(self) -> None:
+    with self._lock:
+      self._db.execute("DELETE FROM responses")
+      self._size = 0
@@ -0,0 +1,63 @@
+import json
+import math
+import os
+from dataclasses import asdict
+
+import numpy as np
+
+from plannen import Plan
+
+
+class Journal:
+  """
+  Append-only JSONL journal of the work done by a fillStationsCSV run.
+
+  It records the plannen found for each station and the area and centroid of
+  the vlakken of each plan. A run started with resume=True reads the journal
+  of the interrupted run back, so finished work is skipped and only what's
+  missing is fetched again. A half-written last line is ignored.
+  """
+
+  def __init__(self, path: str, resume: bool = False):
+    self.path = path
+    self.plannen = {}
+    self.vlakken = {}
+    if resume and os.path.exists(path):
+      self._load()
+      print("> journal:", len(self.plannen), "stations en", len(self.vlakken), "plannen uit", path)
+    self._file = open(path, "a" if resume else "w")
+
+  def _load(self):
+    with open(self.path) as f:
+      for line in f:
+        try:
+          record = json.loads(line)
+        except json.JSONDecodeError:
+          break
+        if record["type"] == "plannen":
+          self.plannen[record["station"]] = [Plan(**plan) for plan in record["plannen"]]
+        elif record["type"] == "vlakken":
+          geometry = np.array(record["geometry"], dtype=float).reshape(-1, 3)
+          self.vlakken[record["plan"]] = (geometry[:, 0], geometry[:, 1], geometry[:, 2])
+
+  def record_plannen(self, station: str, plannen: list):
+    self.plannen[station] = plannen
+    self._write({"type": "plannen", "station": station, "plannen": [asdict(plan) for plan in plannen]})
+
+  def record_vlakken(self, plan_id: str, areas, centers_x, centers_y):
+    self.vlakken[plan_id] = (areas, centers_x, centers_y)
+    # NaN (unparseable vlak) is stored as null
+    geometry = [[None if math.isnan(v) else float(v) for v in row] for row in zip(areas, centers_x, centers_y)]
+    self._write({"type": "vlakken", "plan": plan_id, "geometry": geometry})
+
+  def sync(self):
+    self._file.flush()
+    os.fsync(self._file.fileno())
+
+  def close(self, remove: bool = True):
+    self._file.close()
+    if remove:
+      os.remove(self.path)
+
+  def _write(self, record: dict):
+    self._file.write(json.dumps(record, separators=(",", ":")) + "\n")
@@ -0,0 +1,203 @@
+import random
+import threading
+import time
+from email.utils import parsedate_to_datetime
+
+import requests
+from requests.adapters import HTTPAdapter
+
+import metrics
+
+RETRY_STATUS = {429, 500, 502, 503, 504}
+
+# responses that mean the server wants us to slow down
+THROTTLE_STATUS = {429, 503}
+
+
+class AdaptiveLimiter:
+  """
+  Token bucket plus an adaptive (AIMD) limit on the requests in flight,
+  shared by all threads.
+
+  Every request takes a token from a bucket that refills at `rate` tokens per
+  second up to `burst`, and waits until fewer than `limit` requests are in
+  flight. The limit grows by one per `limit` good responses (additive
+  increase) and is multiplied by `decrease` after a 429 or 503, a connection
+  error or a response slower than `latency_target` seconds (multiplicative
+  decrease), at most once per round trip. A Retry-After pauses all requests.
+  """
+
+  def __init__(self, rate: float = None, burst: float = None, max_concurrency: int = 8, min_concurrency: int = 1, latency_target: float = 5, decrease: float = 0.5):
+    self.rate = rate
+    self.burst = burst or max(rate or 1, 1)
+    self.max_concurrency = max_concurrency
+    self.min_concurrency = min_concurrency
+    self.latency_target = latency_target
+    self.decrease = decrease
+    self.limit = float(max_concurrency)
+    self.in_flight = 0
+    self.throttled = 0
+    self._tokens = self.burst
+    self._updated = time.monotonic()
+    self._resume_at = 0.0
+    self._decreased_until = 0.0
+    self._cond = threading.Condition()
+
+  def acquire(self):
+    """Blocks until a request may be sent."""
+    with self._cond:
+      while self.in_flight >= int(self.limit):
+        self._cond.wait()
+      self.in_flight += 1
+      now = time.monotonic()
+      wait = self._resume_at - now
+      if self.rate:
+        # tokens can go negative, a request waits until its token is refilled
+        self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate) - 1
+        self._updated = now
+        wait = max(wait, -self._tokens / self.rate)
+    if wait > 0:
+      time.sleep(wait)
+
+  def release(self, status: int, latency: float):
+    """Reports the status (None for a connection error) and latency of a request."""
+    with self._cond:
+      self.in_flight -= 1
+      now = time.monotonic()
+      if status is None or status in THROTTLE_STATUS or latency > self.latency_target:
+        if now >= self._decreased_until:
+          self.limit = max(self.min_concurrency, self.limit * self.decrease)
+          self._decreased_until = now + latency
+          self.throttled += 1
+          metrics.count("throttled")
+      else:
+        self.limit = min(self.max_concurrency, self.limit + 1 / self.limit)
+      self._cond.notify_all()
+
+  def pause(self, seconds: float):
+    """Holds back all requests for `seconds`, e.g. for a Retry-After."""
+    with self._cond:
+      self._resume_at = max(self._resume_at, time.monotonic() + seconds)
+
+  def stats(self) -> dict:
+    return {"concurrency_limit": round(self.limit, 2), "throttled": self.throttled}
+
+
+class Client:
+  """
+  Shared HTTP client with keep-alive connection pooling and retries.
+
+  Failed requests (connection errors, timeouts and the status codes in
+  RETRY_STATUS) are retried with exponential backoff and full jitter. A
+  Retry-After header sent by the server takes precedence over the backoff.
+  With a `limiter` (an AdaptiveLimiter) every attempt waits for its turn.
+
+  Requests with a `name` record the round trip of every attempt in the
+  latency metrics under that name. Time spent waiting for the limiter and
+  backing off is reported as the "limiter_wait" and "retry_backoff" stages,
+  summed over all threads.
+  """
+
+  def __init__(self, pool_size: int = 10, retries: int = 5, backoff: float = 0.5, max_backoff: float = 60, timeout: float = 60, limiter: AdaptiveLimiter = None):
+    self.limiter = limiter
+    self.retries = retries
+    self.backoff = backoff
+    self.max_backoff = max_backoff
+    self.timeout = timeout
+    self.retried = 0
+    self._lock = threading.Lock()
+    self.session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=pool_size, max_retries=0)
+    self.session.mount("https://", adapter)
+    self.session.mount("http://", adapter)
+
+  def request(self, method: str, url: str, name: str = None, **kwargs) -> requests.Response:
+    kwargs.setdefault("timeout", self.timeout)
+    attempt = 0
+    while True:
+      status = None
+      if self.limiter:
+        with metrics.stage("limiter_wait"):
+          self.limiter.acquire()
+      start = time.perf_counter()
+      try:
+        response = self.session.request(method, url, **kwargs)
+        status = response.status_code
+        if name:
+          metrics.observe(name, time.perf_counter() - start)
+      except (requests.ConnectionError, requests.Timeout):
+        if attempt >= self.retries:
+          raise
+        delay = self._backoff(attempt)
+      else:
+        if response.status_code not in RETRY_STATUS or attempt >= self.retries:
+          return response
+        delay = self._retry_after(response)
+        if delay is None:
+          delay = self._backoff(attempt)
+        elif self.limiter:
+          self.limiter.pause(delay)
+        # hand the connection back to the pool, a streamed body isn't read otherwise
+        response.close()
+      finally:
+        if self.limiter:
+          self.limiter.release(status, time.perf_counter() - start)
+      with self._lock:
+        self.retried += 1
+      metrics.count("retries")
+      attempt += 1
+      with metrics.stage("retry_backoff"):
+        time.sleep(delay)
+
+  def _backoff(self, attempt: int) -> float:
+    return random.uniform(0, min(self.max_backoff, self.backoff * 2 ** attempt))
+
+  def _retry_after(self, response: requests.Response):
+    value = response.headers.get("Retry-After")
+    if value is None:
+      return None
+    try:
+      delay = float(value)
+    except ValueError:
+      try:
+        delay = parsedate_to_datetime(value).timestamp() - time.time()
+      except (TypeError, ValueError):
+        return None
+    return min(max(delay, 0), self.max_backoff)
+
+  def stats(self) -> dict:
+    """
+    Returns the number of requests sent, new connections opened, connections
+    reused and retries done.
+    """
+    requests_sent, connections = 0, 0
+    for adapter in set(self.session.adapters.values()):
+      pools = adapter.poolmanager.pools
+      for key in pools.keys():
+        pool = pools[key]
+        requests_sent += pool.num_requests
+        connections += pool.num_connections
+    return {
+      "requests": requests_sent,
+      "new_connections": connections,
+      "reused_connections": requests_sent - connections,
+      "retries": self.retried,
+      **(self.limiter.stats() if self.limiter else {}),
+    }
+
+
+_client = Client()
+
+
+def configure(**kwargs):
+  """Replaces the shared client, see Client for the arguments."""
+  global _client
+  _client = Client(**kwargs)
+
+
+def request(method: str, url: str, name: str = None, **kwargs) -> requests.Response:
+  return _client.request(method, url, name=name, **kwargs)
+
+
+def stats() -> dict:
+  return _client.stats()
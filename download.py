@@ -0,0 +1,62 @@
+import json
+import os
+
+import requests
+
+import client
+
+# downloads don't share the Ruimtelijke Plannen client and its adaptive limiter
+_client = client.Client(pool_size=1)
+
+
+def mirror(url: str, path: str, chunk_size: int = 1024 * 1024) -> str:
+  """
+  Keeps a local copy of `url` at `path` up to date.
+
+  The ETag and Last-Modified headers of the last download are stored next to
+  the file and sent back as If-None-Match / If-Modified-Since, so an unchanged
+  file is not transferred again. New files are streamed to disk in chunks.
+  When the server can't be reached the existing copy is used.
+
+  Returns:
+    The path of the local copy.
+  """
+  meta_path = path + ".json"
+  headers = {}
+  if os.path.exists(path) and os.path.exists(meta_path):
+    with open(meta_path) as f:
+      meta = json.load(f)
+    if meta.get("url") != url:
+      meta = {}
+    if meta.get("etag"):
+      headers["If-None-Match"] = meta["etag"]
+    if meta.get("last_modified"):
+      headers["If-Modified-Since"] = meta["last_modified"]
+
+  try:
+    response = _client.request("GET", url, headers=headers, stream=True)
+  except requests.RequestException as e:
+    if os.path.exists(path):
+      print("> download failed, using local copy:", e)
+      return path
+    raise
+
+  with response:
+    if response.status_code == 304:
+      print("> not modified, using local copy of", url)
+      return path
+    response.raise_for_status()
+
+    if os.path.dirname(path):
+      os.makedirs(os.path.dirname(path), exist_ok=True)
+    size = 0
+    with open(path + ".part", "wb") as f:
+      for chunk in response.iter_content(chunk_size=chunk_size):
+        f.write(chunk)
+        size += len(chunk)
+    os.replace(path + ".part", path)
+
+  with open(meta_path, "w") as f:
+    json.dump({"url": url, "etag": response.headers.get("ETag"), "last_modified": response.headers.get("Last-Modified")}, f)
+  print("> downloaded", size, "bytes from", url)
+  return path
@@ -0,0 +1,127 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import geopandas as gpd
+import geopy
+import numpy as np
+import shapely
+
+from cache import ResponseCache
+
+
+class RateLimiter:
+  """Spaces calls from any number of threads at least 1/rate seconds apart."""
+
+  def __init__(self, rate: float):
+    self.interval = 1 / rate
+    self._next = 0.0
+    self._lock = threading.Lock()
+
+  def wait(self):
+    with self._lock:
+      now = time.monotonic()
+      start = max(self._next, now)
+      self._next = start + self.interval
+    time.sleep(start - now)
+
+
+class NominatimGeocoder:
+  """
+  Reverse geocodes points to postcodes with Nominatim. The public service
+  allows one request per second, raise `rate` for a self-hosted instance.
+  """
+
+  def __init__(self, user_agent: str = "check_1", rate: float = 1.0):
+    self.geolocator = geopy.Nominatim(user_agent=user_agent)
+    self.limiter = RateLimiter(rate)
+
+  def postcode(self, lat: float, lon: float):
+    self.limiter.wait()
+    location = self.geolocator.reverse(f"{lat}, {lon}")
+    if location is None:
+      return None
+    return location.raw.get('address', {}).get('postcode')
+
+
+class LocalGeocoder:
+  """
+  Looks up postcodes offline in a local dataset, for example a PC6
+  GeoPackage. Polygons are matched point-in-polygon (falling back to the
+  nearest polygon for points outside all of them), points by nearest
+  neighbour. Everything is answered from an in-memory STRtree.
+  """
+
+  COLUMNS = ("postcode", "pc6", "PC6", "postcode6", "POSTCODE")
+
+  def __init__(self, path: str, column: str = None):
+    data = gpd.read_file(path).to_crs(epsg=4326)
+    if column is None:
+      column = next((c for c in self.COLUMNS if c in data.columns), None)
+      if column is None:
+        raise ValueError(f"no postcode column in {path}, expected one of {self.COLUMNS}")
+    data = data[data.geometry.notna()]
+    self.postcodes = data[column].astype(str).to_numpy()
+    self.geometries = data.geometry.to_numpy()
+    self.polygons = bool(shapely.get_dimensions(self.geometries).max() == 2)
+    self.tree = shapely.STRtree(self.geometries)
+
+  def postcode(self, lat: float, lon: float):
+    return self.postcode_many([(lat, lon)])[0]
+
+  def postcode_many(self, points) -> list:
+    lats, lons = np.asarray(points, dtype=float).reshape(-1, 2).T
+    points = shapely.points(lons, lats)
+    match = np.full(len(points), -1)
+    if self.polygons:
+      point_index, geometry_index = self.tree.query(points, predicate="intersects")
+      # keep the first polygon a point falls in
+      match[point_index[::-1]] = geometry_index[::-1]
+    outside = np.flatnonzero(match < 0)
+    if len(outside):
+      point_index, geometry_index = self.tree.query_nearest(points[outside], all_matches=False)
+      match[outside[point_index]] = geometry_index
+    return [self.postcodes[i] for i in match]
+
+
+def postcodes(points, geocoder, cache_path="./cache/postcodes.sqlite", precision: int = 4, workers: int = 2) -> list:
+  """
+  Looks up the postcode of every (lat, lon) point.
+
+  Coordinates are rounded to `precision` decimals (4 is about 10 m) and
+  looked up in a persistent cache first, so unchanged stations are never
+  geocoded again. The remaining points are resolved concurrently by
+  `workers` threads; the geocoder is responsible for its own rate limit.
+  Geocoders with a `postcode_many` method (LocalGeocoder) are fast enough
+  to skip the cache and get all points, unrounded, in one call.
+
+  Returns:
+    A list with a postcode (or None) per point.
+  """
+  if hasattr(geocoder, "postcode_many"):
+    # exact coordinates, PC6 areas can be narrower than the rounding
+    points = [(lat, lon) for lat, lon in points]
+    unique = list(dict.fromkeys(points))
+    found = dict(zip(unique, geocoder.postcode_many(unique)))
+    return [found[point] for point in points]
+
+  keys = [(round(lat, precision), round(lon, precision)) for lat, lon in points]
+
+  cache = ResponseCache(cache_path, ttl=float("inf"), max_bytes=2**63) if cache_path else None
+  found = {}
+  for key in dict.fromkeys(keys):
+    cached = cache.get(ResponseCache.key("postcode", key)) if cache else None
+    if cached is not None:
+      found[key] = cached["postcode"]
+  missing = [key for key in dict.fromkeys(keys) if key not in found]
+  print("> postcodes:", len(found), "uit cache,", len(missing), "opzoeken")
+
+  def lookup(key):
+    postcode = geocoder.postcode(*key)
+    if cache:
+      cache.set(ResponseCache.key("postcode", key), {"postcode": postcode})
+    return postcode
+
+  with ThreadPoolExecutor(max_workers=workers) as pool:
+    found.update(zip(missing, pool.map(lookup, missing)))
+  return [found[key] for key in keys]
@@ -0,0 +1,59 @@
+import os
+import sqlite3
+import threading
+import time
+
+import numpy as np
+
+
+class GeometryStore:
+  """
+  On-disk store of the area and centroid of every vlak of a plan, together
+  with the version of the plan they were computed for.
+
+  Unlike the response cache entries never expire: a plan's vlakken are only
+  downloaded again when the version reported by plannen/_zoek changes.
+  """
+
+  def __init__(self, path: str):
+    if os.path.dirname(path):
+      os.makedirs(os.path.dirname(path), exist_ok=True)
+    self.hits = 0
+    self.misses = 0
+    self._lock = threading.Lock()
+    self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+    self._db.execute("""
+      CREATE TABLE IF NOT EXISTS plans (
+        id TEXT PRIMARY KEY,
+        version TEXT NOT NULL,
+        geometry BLOB NOT NULL,
+        stored_at REAL NOT NULL
+      )""")
+
+  def get(self, plan_id: str, version: str):
+    """
+    Returns (areas, centers_x, centers_y) stored for `plan_id`, or None when
+    the plan is missing, stored for another version or `version` is unknown.
+    """
+    with self._lock:
+      row = None
+      if version is not None:
+        row = self._db.execute("SELECT geometry FROM plans WHERE id = ? AND version = ?", (plan_id, version)).fetchone()
+      if row is None:
+        self.misses += 1
+        return None
+      self.hits += 1
+    geometry = np.frombuffer(row[0], dtype=np.float64).reshape(3, -1)
+    return geometry[0], geometry[1], geometry[2]
+
+  def set(self, plan_id: str, version: str, areas, centers_x, centers_y) -> None:
+    if version is None:
+      return
+    geometry = np.array([areas, centers_x, centers_y], dtype=np.float64).tobytes()
+    with self._lock:
+      self._db.execute("INSERT OR REPLACE INTO plans VALUES (?, ?, ?, ?)", (plan_id, version, geometry, time.time()))
+
+  def stats(self) -> dict:
+    with self._lock:
+      plans = self._db.execute("SELECT COUNT(*) FROM plans").fetchone()[0]
+    return {"plans": plans, "hits": self.hits, "misses": self.misses}
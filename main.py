@@ -1,146 +1,230 @@
+import os
 import sys
 import argparse
-import pandas as pd
+import numpy as np
 import warnings
 warnings.filterwarnings("ignore")
 
 # import eigen modules
 import parse_stations
 import update
+import api
+import checkpoint
+import metrics
+import client
 import plannen
 import vlakken
+import writers
+from geometry_store import GeometryStore
+from stations import load_stations, generate_points, generate_areas, cluster_stations, PATTERNS, SEARCH_SHAPES
 
 # Add arguments
 parser = argparse.ArgumentParser(description='Main script for updating the data')
 parser.add_argument('--update', action='store_true', dest="update")
+parser.add_argument('--incremental', action='store_true', dest="incremental", help="with --update: only redo stations that were added or moved since the last run")
+parser.add_argument('--postcodes', dest="postcodes", help="local postcode GeoPackage (e.g. PC6) for offline geocoding during --update")
+parser.add_argument('--workers', type=int, default=8, dest="workers", help="max number of concurrent API requests")
+parser.add_argument('--rate', type=float, dest="rate", help="max API requests per second (default: no fixed limit, only the adaptive concurrency)")
+parser.add_argument('--latency-target', type=float, default=5, dest="latency_target", help="seconds; slower API responses lower the number of concurrent requests")
+parser.add_argument('--geometry-workers', type=int, default=os.cpu_count(), dest="geometry_workers", help="processes that compute the area and centroid of the vlakken (1: no extra processes)")
+parser.add_argument('--format', nargs='+', default=[], choices=sorted(writers.EXTENSIONS), dest="formats", help="extra output formats written next to the CSV files (needs pyarrow)")
+parser.add_argument('--search', default="points", choices=["points"] + SEARCH_SHAPES, dest="search", help="search plannen at probe points around each station, or with one query for a buffer or bounding box of --probe-radius around it")
+parser.add_argument('--probes', default="cross", choices=PATTERNS, dest="probes", help="pattern of the points around each station that are searched for plannen")
+parser.add_argument('--probe-radius', type=float, default=1000, dest="probe_radius", help="meters from the station to the outermost probe points, or the edge of the search area")
+parser.add_argument('--probe-count', type=int, dest="probe_count", help="points on the ring (ring, default 8) or number of rings (hex, default 2)")
+parser.add_argument('--cluster-radius', type=float, default=0, dest="cluster_radius", help="stations within this many meters of each other share one plan search (0: only stations on the same spot)")
+parser.add_argument('--batch-size', type=int, default=50, dest="batch_size", help="number of stations fetched and written per batch")
+parser.add_argument('--resume', action='store_true', dest="resume", help="continue an interrupted run, skipping the stations, plannen and vlakken it already finished")
+parser.add_argument('--offline', action='store_true', dest="offline", help="answer all API requests from the response cache")
+parser.add_argument('--no-cache', action='store_true', dest="no_cache", help="don't use the on-disk response cache")
+parser.add_argument('--refetch', action='store_true', dest="refetch", help="download the vlakken of every plan again, also when its version didn't change")
+parser.add_argument('--cache-ttl', type=float, default=30, dest="cache_ttl", help="days before a cached API response expires")
+parser.add_argument('--record', dest="record", help="also write every API response to this directory as a fixture for replay.py")
+parser.add_argument('--report', default="./output/run_report.json", dest="report", help="where to write the JSON run report (timings, latencies, counters)")
 args = parser.parse_args()
+if args.update and args.resume:
+  # the update already rewrote the stations; --resume alone continues with the stations it left
+  parser.error("--resume continues an interrupted run, run it without --update")
+
+client.configure(pool_size=args.workers, limiter=client.AdaptiveLimiter(rate=args.rate, max_concurrency=args.workers, latency_target=args.latency_target))
+writers.configure(args.formats)
+api.configure(cache_path=None if args.no_cache else "./cache/responses.sqlite", ttl_days=args.cache_ttl, offline=args.offline, record=args.record)
 
 # Update all the files if: > main.py --update
+changes = None
 if args.update:
-  update.update()
-
-def generate_points(stations, range=1):
-  new_stations = []
-  for station in stations:
-    cord = station["geometry"]
-    lon_str, lat_str = cord.replace("(", "").replace(")", "").split(" ")
-    lon, lat = float(lon_str), float(lat_str)
-    station["points_around"] = [
-      {
-        "lon": lon,
-        "lat": lat 
-      },
-      {
-        "lon": lon + range * 0.01,
-        "lat": lat 
-      },
-      {
-        "lon": lon,
-        "lat": lat + range * 0.006
-      },
-      {
-        "lon": lon - range * 0.01,
-        "lat": lat 
-      },
-      {
-        "lon": lon,
-        "lat": lat - range * 0.006
-      },
-    ]
-    new_stations.append(station)
-  return new_stations
-
-def fillStationsCSV():
-  df_stations = pd.read_csv("./output/beschikbare_capaciteit_elektriciteitsnet.csv")
-  
-  stations = []
-  for index, row in df_stations.iterrows():
-    stations.append({
-      "zip_code": row["zip_code"],
-      "beschikbare_capaciteit_invoeding_huidig_mva": row["beschikbare_capaciteit_invoeding_huidig_mva"],
-      "beschikbare_capaciteit_afname_huidig_mva": row["beschikbare_capaciteit_afname_huidig_mva"],
-      "geometry": row["geometry"],
-      "name": row["station"]
-    })
-  
-  stations = generate_points(stations, range=1)
-
-  new_stations = []
-  i = 0
-  for station in stations:
-    i+= 1
-    if i > float("inf"): 
-      break
-    print("> loading station", i, "van", len(stations))
-    ruimtelijke_plannen = plannen.get_plan(station)
-    print(ruimtelijke_plannen)
-    station["plannen"] = ruimtelijke_plannen
-    new_stations.append(station)
-  
-  print(new_stations)
-  # df = pd.DataFrame(columns=["zip_code", "beschikbare_capaciteit_invoeding_huidig_mva", "beschikbare_capaciteit_afname_huidig_mva", "station_location", "center_vlak", "area_vlak", "distance_to_vlak"]) # dataframe for the vlakken
-  
-  end_dictionary = {"zip_code": [], "beschikbare_capaciteit_invoeding_huidig_mva": [], "beschikbare_capaciteit_afname_huidig_mva": [], "station_lat": [], "station_long": [], "center_vlak_lat": [], "center_vlak_long": [], "area_vlak": [], "distance_to_station": [], "name": [] }
-
-  stations = new_stations
-  i = 0
-  for station in stations:
-    i+= 1
-    print("> vlakken ophalen: ", i , "van", len(stations))
-    bestemmings_vlakken = []
-    j = 0
-    for plan in station["plannen"]:
-      j+= 1
-      print("> vlakken ophalen: ", j, "van", len(station["plannen"]))
-      # Get data for plan:
-      vlak = vlakken.get_vlakken(plan["id"])
-      bestemmings_vlakken.extend(vlak)
-    
-    print("> data berekenen...")
-    for vlak in bestemmings_vlakken:
-      try:
-        # lon = x
-        # lat = y
-        area, center  = vlakken.calc_area_and_centoid(vlak["geometrie"]['coordinates'][0])
-        lat_str, lon_str = station["geometry"].replace("(", "").replace(")", "").split(" ")
-        lon, lat = float(lon_str), float(lat_str)
-        distance = vlakken.calc_distance(lon, lat, center.x, center.y)
-        
-        # add data to dict
-        end_dictionary["zip_code"].append(station["zip_code"])
-        end_dictionary["name"].append(station["name"])
-        end_dictionary["beschikbare_capaciteit_invoeding_huidig_mva"].append(station["beschikbare_capaciteit_invoeding_huidig_mva"])
-        end_dictionary["beschikbare_capaciteit_afname_huidig_mva"].append(station["beschikbare_capaciteit_afname_huidig_mva"])
-        end_dictionary["station_lat"].append(lat)
-        end_dictionary["station_long"].append(lon)
-        end_dictionary["center_vlak_lat"].append(center.y)
-        end_dictionary["center_vlak_long"].append(center.x)
-        end_dictionary["area_vlak"].append(area)
-        end_dictionary["distance_to_station"].append(distance)
-      except Exception as e:
-        print("Couldn't parse it...", e)
-  print(end_dictionary)
-    
-  df = pd.DataFrame(end_dictionary)
-  print(df.head())
-  #save dataframe to csv
-  df.to_csv("./output/station_data.csv")
+  with metrics.stage("update"):
+    changes = update.update(postcode_file=args.postcodes, incremental=args.incremental)
+
+STATION_DATA_COLUMNS = ["zip_code", "beschikbare_capaciteit_invoeding_huidig_mva", "beschikbare_capaciteit_afname_huidig_mva", "station_lat", "station_long", "center_vlak_lat", "center_vlak_long", "area_vlak", "distance_to_station", "name"]
+
+def station_key(station) -> str:
+  return f'{station.name} {station.geometry}'
+
+def station_rows(stations, summary, journal, store=None, pool=None, batch_size=50):
+  """
+  Yields (station, rows) for every station, where rows is a dict with the
+  STATION_DATA_COLUMNS of the station's vlakken.
+
+  Stations are handled `batch_size` at a time: their plannen are fetched,
+  then the vlakken of plannen that weren't fetched for an earlier batch, and
+  only the area and centroid of each vlak is kept so memory stays bounded.
+  Everything fetched is recorded in `journal` (a checkpoint.Journal), and
+  whatever the journal already knows is not fetched again. The vlakken of
+  plannen that are in `store` (a GeometryStore) for their current version
+  aren't fetched either. The geometry is computed in the process `pool`
+  when one is given (see vlakken.process_pool).
+  `summary` is updated with the number of plan references and unique plannen.
+  """
+  geometry_per_plan = journal.vlakken
+  for start in range(0, len(stations), batch_size):
+    batch = stations[start:start + batch_size]
+    todo = [station for station in batch if station_key(station) not in journal.plannen]
+    # a station in the cluster of a station from an earlier batch shares its plannen,
+    # unless it has a probe of its own
+    shared = [station for station in todo if station_key(station.cluster) in journal.plannen and station.points_around == station.cluster.points_around]
+    for station in shared:
+      journal.record_plannen(station_key(station), journal.plannen[station_key(station.cluster)])
+    metrics.count("plan_queries_saved", sum(1 if station.search_area else len(station.points_around) for station in shared))
+    todo = [station for station in todo if station_key(station) not in journal.plannen]
+    print("> loading plannen for stations", start + 1, "-", start + len(batch), "van", len(stations), "with", args.workers, "workers")
+    with metrics.stage("fetch_plans"):
+      for station, ruimtelijke_plannen in zip(todo, plannen.get_plans(todo, workers=args.workers, by_area=args.search != "points")):
+        journal.record_plannen(station_key(station), ruimtelijke_plannen)
+    for station in batch:
+      station.plannen = journal.plannen[station_key(station)]
+
+    # Neighbouring stations often share plannen, so fetch every plan only once
+    summary["plan_references"] += sum(len(station.plannen) for station in batch)
+    new_plans = [plan for plan in plannen.filter_unique_plans(plan for station in batch for plan in station.plannen) if plan.id not in geometry_per_plan]
+    summary["unique_plans"] += len(new_plans)
+    # plannen whose version didn't change since the vlakken were stored aren't downloaded again
+    if store is not None and not args.refetch:
+      for plan in new_plans:
+        stored = store.get(plan.id, plan.versie)
+        if stored is not None:
+          journal.record_vlakken(plan.id, *stored)
+    versions = {plan.id: plan.versie for plan in new_plans}
+    plan_ids = [plan.id for plan in new_plans if plan.id not in geometry_per_plan]
+    summary["plans_from_store"] += len(new_plans) - len(plan_ids)
+    print("> vlakken ophalen voor", len(plan_ids), "nieuwe plannen")
+    rings_per_plan = {}
+    with metrics.stage("fetch_vlakken"):
+      # only the exterior ring of every vlak is kept, page by page
+      for plan_id, (rings, pages) in vlakken.get_vlakken_for_plans(plan_ids, workers=args.workers, transform=vlakken.exterior_ring).items():
+        print(">", plan_id, ":", pages.items, "vlakken in", pages.pages, "pagina's")
+        metrics.count("vlakken_pages", pages.pages)
+        rings_per_plan[plan_id] = rings
+
+    with metrics.stage("geometry"):
+      # Area and centroid of all new vlakken in one vectorized pass
+      rings = [ring for plan_id in plan_ids for ring in rings_per_plan[plan_id]]
+      areas, centers_x, centers_y = vlakken.calc_area_and_centroid_batch(rings, pool=pool, workers=args.geometry_workers)
+      offset = 0
+      for plan_id in plan_ids:
+        n = len(rings_per_plan[plan_id])
+        journal.record_vlakken(plan_id, areas[offset:offset + n], centers_x[offset:offset + n], centers_y[offset:offset + n])
+        if store is not None:
+          store.set(plan_id, versions[plan_id], *geometry_per_plan[plan_id])
+        offset += n
+      journal.sync()
+      del rings_per_plan, rings
+
+      batch_rows = [calc_station_rows(station, geometry_per_plan) for station in batch]
+    yield from zip(batch, batch_rows)
+
+def calc_station_rows(station, geometry_per_plan) -> dict:
+  lon, lat = station.lon, station.lat
+  plan_geometry = [geometry_per_plan[plan.id] for plan in station.plannen]
+  if not plan_geometry:
+    return {column: [] for column in STATION_DATA_COLUMNS}
+  # lon = x
+  # lat = y
+  station_areas, centers_x, centers_y = (np.concatenate(column) for column in zip(*plan_geometry))
+  parsed = ~np.isnan(station_areas)
+  if not parsed.all():
+    print("Couldn't parse", (~parsed).sum(), "vlakken...")
+  station_areas, centers_x, centers_y = station_areas[parsed], centers_x[parsed], centers_y[parsed]
+  distances = vlakken.calc_distance_batch(lon, lat, centers_x, centers_y)
+
+  n = len(distances)
+  return {
+    "zip_code": [station.zip_code] * n,
+    "beschikbare_capaciteit_invoeding_huidig_mva": [station.beschikbare_capaciteit_invoeding_huidig_mva] * n,
+    "beschikbare_capaciteit_afname_huidig_mva": [station.beschikbare_capaciteit_afname_huidig_mva] * n,
+    "station_lat": [lat] * n,
+    "station_long": [lon] * n,
+    "center_vlak_lat": centers_y,
+    "center_vlak_long": centers_x,
+    "area_vlak": station_areas,
+    "distance_to_station": distances,
+    "name": [station.name] * n,
+  }
+
+def fillStationsCSV(only=None, resume=False):
+  """
+  Parameters:
+    only: Optional collection of (station, netbeheerder) keys. Only these stations
+      are processed and their rows are appended to the existing station_data.csv.
+    resume: Continue an interrupted run after its last completed station.
+  """
+  if only is not None and len(only) == 0:
+    print("> no added or moved stations, station_data.csv is up to date")
+    update.clear_pending()
+    return
+
+  with metrics.stage("load_csv"):
+    stations = load_stations("./output/beschikbare_capaciteit_elektriciteitsnet.csv", only=only)
+
+  with metrics.stage("generate_points"):
+    # every cluster of nearby stations is searched once, around its leader
+    leaders = stations[cluster_stations(stations, radius=args.cluster_radius)]
+    if args.search == "points":
+      generate_points(leaders, pattern=args.probes, radius=args.probe_radius, count=args.probe_count)
+    else:
+      generate_areas(leaders, shape=args.search, radius=args.probe_radius + args.cluster_radius)
+    for station in stations:
+      station.points_around, station.search_area = station.cluster.points_around, station.cluster.search_area
+      if station.points_around is not None and (station.lat, station.lon) not in station.points_around:
+        # the leader's probes don't cover a member's own spot, so it is searched as well
+        station.points_around = station.points_around + [(station.lat, station.lon)]
+
+  # Rows are appended to the CSV in batches while the stations are processed
+  writer = writers.RowWriter("./output/station_data.csv", STATION_DATA_COLUMNS, resume=resume, append=only is not None)
+  journal = checkpoint.Journal("./output/station_data.csv.journal", resume=resume)
+  store = None if args.no_cache else GeometryStore("./cache/geometry.sqlite")
+  summary = {"stations": len(stations), "clusters": len(leaders), "plan_references": 0, "unique_plans": 0, "plans_from_store": 0}
+  pool = vlakken.process_pool(args.geometry_workers)
+  try:
+    for station, rows in station_rows(stations[writer.stations_done:], summary, journal, store=store, pool=pool, batch_size=args.batch_size):
+      with metrics.stage("write"):
+        writer.write(rows)
+        writer.station_done()
+  finally:
+    if pool is not None:
+      pool.shutdown(cancel_futures=True)
+  with metrics.stage("write"):
+    writer.close()
+  journal.close()
+  update.clear_pending()
+
+  summary["vlakken_calls_saved"] = summary["plan_references"] - summary["unique_plans"] + summary["plans_from_store"]
+  summary["rows"] = writer.rows
+  print("> run summary:", summary)
+  print("> cache:", api.cache_stats())
+  if store is not None:
+    print("> geometry store:", store.stats())
+  print("> http:", client.stats())
+  if args.report:
+    metrics.write_report(args.report, summary=summary, cache=api.cache_stats(), http=client.stats())
+    print("> run report:", args.report)
     
 
 
 def test():
   print("> RUNNING TEST!")
   print("> Loading data...")
-  df_stations = pd.read_csv("./output/beschikbare_capaciteit_elektriciteitsnet.csv")
-  
-  stations = []
-  for index, row in df_stations.iterrows():
-    stations.append({
-      "zip_code": row["zip_code"],
-      "beschikbare_capaciteit_invoeding_huidig_mva": row["beschikbare_capaciteit_invoeding_huidig_mva"],
-      "beschikbare_capaciteit_afname_huidig_mva": row["beschikbare_capaciteit_afname_huidig_mva"],
-      "geometry": row["geometry"]
-    })
+  stations = load_stations("./output/beschikbare_capaciteit_elektriciteitsnet.csv")
   
   print("> Generating points...")
   stations = generate_points(stations)
@@ -148,16 +232,16 @@ def test():
   print("> Requesting plannen...")
   station = stations[0]
   ruimtelijke_plannen = plannen.get_plan(station)
-  station["plannen"] = ruimtelijke_plannen
+  station.plannen = ruimtelijke_plannen
   print(station)
   bestemmings_vlakken = []
   print("> Requesting vlakken...")
 
 
-  for plan in station["plannen"]:
+  for plan in station.plannen:
     # print(plan)
     # Get data for plan:
-    vlak = vlakken.get_vlakken(plan["id"])
+    vlak = vlakken.get_vlakken(plan.id)
     bestemmings_vlakken.extend(vlak)
   for vlak in bestemmings_vlakken:
     try:
@@ -169,9 +253,7 @@ def test():
   for vlak in bestemmings_vlakken:
     try:
       area, center  = vlakken.calc_area_and_centoid(vlak["geometrie"]['coordinates'][0])
-      lat_str, lon_str  = station["geometry"].replace("(", "").replace(")", "").split(" ")
-      lon, lat = float(lon_str), float(lat_str)
-      distance = vlakken.calc_distance(lon, lat, center.x, center.y)
+      distance = vlakken.calc_distance(station.lon, station.lat, center.x, center.y)
       print(distance, area)
     except:
       print("Couldn't parse it...")
@@ -180,6 +262,10 @@ def test():
 
 
 if __name__ == "__main__":
-  fillStationsCSV()
+  if changes is not None:
+    fillStationsCSV(only=changes["added"].append(changes["moved"]))
+  else:
+    # an interrupted incremental run only continues with its own stations
+    fillStationsCSV(only=update.load_pending() if args.resume else None, resume=args.resume)
   # test()
 
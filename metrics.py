@@ -0,0 +1,69 @@
+import bisect
+import json
+import threading
+import time
+from contextlib import contextmanager
+
+# upper bounds (seconds) of the latency histogram buckets
+LATENCY_BUCKETS = [0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, float("inf")]
+
+_lock = threading.Lock()
+_stages = {}
+_latencies = {}
+_counters = {}
+_started = time.time()
+
+
+@contextmanager
+def stage(name: str):
+  """Adds the wall and CPU time spent in the with block to stage `name`."""
+  wall, cpu = time.perf_counter(), time.process_time()
+  try:
+    yield
+  finally:
+    wall, cpu = time.perf_counter() - wall, time.process_time() - cpu
+    with _lock:
+      totals = _stages.setdefault(name, {"calls": 0, "wall_s": 0.0, "cpu_s": 0.0})
+      totals["calls"] += 1
+      totals["wall_s"] += wall
+      totals["cpu_s"] += cpu
+
+
+def observe(endpoint: str, seconds: float):
+  """Records the latency of one request to `endpoint`."""
+  with _lock:
+    latency = _latencies.setdefault(endpoint, {"count": 0, "sum_s": 0.0, "max_s": 0.0, "buckets": [0] * len(LATENCY_BUCKETS)})
+    latency["count"] += 1
+    latency["sum_s"] += seconds
+    latency["max_s"] = max(latency["max_s"], seconds)
+    latency["buckets"][bisect.bisect_left(LATENCY_BUCKETS, seconds)] += 1
+
+
+def count(name: str, n: int = 1):
+  with _lock:
+    _counters[name] = _counters.get(name, 0) + n
+
+
+def report() -> dict:
+  with _lock:
+    latencies = {}
+    for endpoint, latency in _latencies.items():
+      latencies[endpoint] = {
+        "count": latency["count"],
+        "mean_s": latency["sum_s"] / latency["count"],
+        "max_s": latency["max_s"],
+        "buckets": {("+inf" if bound == float("inf") else str(bound)): n for bound, n in zip(LATENCY_BUCKETS, latency["buckets"])},
+      }
+    return {
+      "started": time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(_started)),
+      "duration_s": time.time() - _started,
+      "stages": {name: dict(totals) for name, totals in _stages.items()},
+      "latency": latencies,
+      "counters": dict(_counters),
+    }
+
+
+def write_report(filename: str, **extra):
+  """Writes report() plus the `extra` fields to `filename` as JSON."""
+  with open(filename, "w") as f:
+    json.dump(dict(report(), **extra), f, indent=2)
@@ -1,13 +1,16 @@
+import os
 import geopandas as gpd
-import geopy
+import numpy as np
 import pandas as pd
 import requests
 
-def get_zip_code(point, geolocator):
-    location = geolocator.reverse(f"{point.y}, {point.x}")
-    return location.raw['address']['postcode']
+import download
+import geocode
+import writers
 
-def parseStationsGPKG(min_in: int, min_out: int):
+GPKG_MIRROR = "./cache/beschikbare_capaciteit_elektriciteitsnet.gpkg"
+
+def parseStationsGPKG(min_in: int, min_out: int, geocode_precision: int = 4, geocode_workers: int = 2, postcode_file: str = None, with_zip_codes: bool = True):
   """
     Parses a GeoPackage file containing stations data and filters it
     based on several conditions.
@@ -18,6 +21,11 @@ def parseStationsGPKG(min_in: int, min_out: int):
                 for a station to be included in the output.
         min_out: An integer representing the minimum value of beschikbare_capaciteit_afname_huidig_mva
                 for a station to be included in the output.
+        geocode_precision: Number of decimals coordinates are rounded to for the postcode cache.
+        geocode_workers: Number of concurrent reverse geocoding requests.
+        postcode_file: Optional local postcode dataset (e.g. a PC6 GeoPackage) to geocode
+                offline instead of with Nominatim.
+        with_zip_codes: Whether to add the zip_code column, see addZipCodes.
 
     Returns:
         A GeoDataFrame containing the filtered data.
@@ -25,7 +33,9 @@ def parseStationsGPKG(min_in: int, min_out: int):
 
   url = "https://service.pdok.nl/kadaster/netcapaciteit/atom/v1_0/downloads/beschikbare_capaciteit_elektriciteitsnet.gpkg"
 
-  data = gpd.read_file(url)
+  # let the GPKG (SQLite) driver memory-map the local copy
+  os.environ.setdefault("OGR_SQLITE_PRAGMA", "mmap_size=1073741824")
+  data = gpd.read_file(download.mirror(url, GPKG_MIRROR))
 
   data["beschikbare_capaciteit_invoeding_huidig_mva"] = pd.to_numeric(data['beschikbare_capaciteit_invoeding_huidig_mva'],errors='coerce')
   data["beschikbare_capaciteit_afname_huidig_mva"] = pd.to_numeric(data['beschikbare_capaciteit_afname_huidig_mva'],errors='coerce')
@@ -54,16 +64,46 @@ def parseStationsGPKG(min_in: int, min_out: int):
   data = data.to_crs(epsg=4326)
 
   # Get zipcode
-  geolocator = geopy.Nominatim(user_agent="check_1")
-  data["zip_code"] = data.apply(lambda x: get_zip_code(x.geometry.centroid, geolocator), axis=1)
+  if with_zip_codes:
+    addZipCodes(data, geocode_precision, geocode_workers, postcode_file)
 
   return data
 
+def addZipCodes(data, geocode_precision: int = 4, geocode_workers: int = 2, postcode_file: str = None, rows=None):
+  """
+    Reverse geocodes the stations in `data` and stores the result in its zip_code column.
+
+    Args:
+        data: A GeoDataFrame in crs=4326.
+        geocode_precision, geocode_workers, postcode_file: See parseStationsGPKG.
+        rows: Optional boolean mask of the rows to geocode, the other rows keep their zip_code.
+  """
+  if postcode_file:
+    geocoder = geocode.LocalGeocoder(postcode_file)
+  else:
+    geocoder = geocode.NominatimGeocoder(user_agent="check_1")
+  if rows is None:
+    rows = pd.Series(True, index=data.index)
+  centroids = data.geometry[rows].centroid
+  data.loc[rows, "zip_code"] = geocode.postcodes(
+    list(zip(centroids.y, centroids.x)),
+    geocoder,
+    precision=geocode_precision,
+    workers=geocode_workers,
+  )
+
+def parseGeometry(geometry):
+  """
+    Splits a column of "(a b)" strings, as written by writeStationsToCSV, into two float arrays.
+  """
+  if len(geometry) == 0:
+    return np.empty(0), np.empty(0)
+  parts = geometry.str.strip("()").str.split(" ", n=1, expand=True).astype(float)
+  return parts[0].to_numpy(), parts[1].to_numpy()
+
 def writeStationsToCSV(data, filename: str):
-  csv_data = data.to_csv().replace("POINT ", "")
-  #write data to file:
-  with open(filename, "w") as f:
-    f.write(csv_data)
+  # writes the CSV and any extra formats set with writers.configure
+  writers.write_table(data, filename)
 
 def getCoordsFromZip(zip: str):
   # geolocator = geopy.Nominatim(user_agent="check_1")
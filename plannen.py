@@ -1,11 +1,28 @@
-import requests
 from dotenv import load_dotenv
 import os
 import json
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+
+import api
+import metrics
 
 load_dotenv()
 
-def plan_request(lat: float, lon: float):
+# Searches are only cached for a day, long enough to resume a run but short
+# enough that the monthly run sees new plannen and new plan versions
+ZOEK_CACHE_TTL = 24 * 3600
+
+@dataclass(frozen=True, slots=True)
+class Plan:
+  """A bestemmingsplan, plans are equal (and hash) by their id."""
+  id: str
+  naam: str = field(compare=False)
+  parapluplan: bool = field(compare=False)
+  versie: str = field(default=None, compare=False)
+
+def zoek_plannen(geo: dict, name: str):
+  """Searches the plannen matching the `_geo` filter `geo`, following all pages."""
   headers = {
     'accept': 'application/hal+json',
     'Content-Crs': 'epsg:4258',
@@ -15,56 +32,94 @@ def plan_request(lat: float, lon: float):
   }
 
   params = {
-    'page': '1',
-    'pageSize': '10',
     'beleidsmatigVerantwoordelijkeOverheid.type': 'gemeentelijke overheid',
     'publicerendBevoegdGezag.type': 'gemeentelijke overheid',
     'planType': 'bestemmingsplan',
     'regelStatus': 'geldend',
   }
 
-  json_data = {
-    '_geo': {
+  return list(api.Pages(
+      'POST',
+      '/plannen/_zoek',
+      'plannen',
+      params=params,
+      headers=headers,
+      json={'_geo': geo},
+      name=name,
+      ttl=ZOEK_CACHE_TTL,
+  ))
+
+def plan_request(lat: float, lon: float):
+  # the plannen that contain the point
+  return zoek_plannen({
     'contains': {
       'type': 'Point',
       'coordinates': [
-        lat,
         lon,
+        lat,
       ]},
-    },
-  }
+    }, name='plan_request')
 
-  response = requests.post(
-      'https://ruimte.omgevingswet.overheid.nl/ruimtelijke-plannen/api/opvragen/v4/plannen/_zoek',
-      params=params,
-      headers=headers,
-      json=json_data,
-  )
-
-  return response.json()
+def area_request(area: dict):
+  # the plannen that intersect the GeoJSON polygon `area`
+  return zoek_plannen({'intersects': area}, name='area_request')
 
 def filter_unique_plans(plannen):
-  unique_plans = []
-  for plan in plannen:
-    if plan not in unique_plans:
-      unique_plans.append(plan)
-  return unique_plans
+  # dicts keep insertion order, so this drops duplicates in O(n) and keeps the first one
+  return list(dict.fromkeys(plannen))
 
-def get_plan(station):
-  coords = station["points_around"]
+def plan_version(plan: dict):
+  # a new version of a plan changes its status or the date of that status
+  info = plan.get("planstatusInfo")
+  if not info:
+    return None
+  return f'{info.get("planstatus")} {info.get("datum")}'
+
+def parse_plannen(responses):
   plannen = []
-  for coord in coords:
-    lon = coord["lon"]
-    lat = coord["lat"]
-    res = plan_request(lat, lon)
-    for plan in res["_embedded"]["plannen"]:
-      plan = {
-        "id": plan["id"],
-        "naam": plan["naam"],
-        "parapluplan": plan["isParapluplan"],
-      }
-      if not plan['parapluplan']:
+  for res in responses:
+    for plan in res:
+      plan = Plan(
+        id=plan["id"],
+        naam=plan["naam"],
+        parapluplan=plan["isParapluplan"],
+        versie=plan_version(plan),
+      )
+      if not plan.parapluplan:
         plannen.append(plan)
   return filter_unique_plans(plannen)
 
- 
\ No newline at end of file
+def get_plan(station):
+  responses = [plan_request(lat, lon) for lat, lon in station.points_around]
+  return parse_plannen(responses)
+
+def get_plans(stations, workers=8, by_area=False):
+  """
+  Fetches the plannen for all stations at once, with at most `workers`
+  queries in flight.
+
+  Args:
+    stations: Stations with their points_around set (see stations.generate_points),
+      or with by_area their search_area (see stations.generate_areas).
+    workers: The maximum number of concurrent requests.
+    by_area: Search once per station with its search_area instead of once per point.
+
+  Returns:
+    A list with the unique plannen per station, in the same order as `stations`.
+  """
+  if by_area:
+    # stations on the same spot or in the same cluster have the same area, every area is queried once
+    areas = {json.dumps(station.search_area): station.search_area for station in stations}
+    metrics.count("plan_queries", len(areas))
+    metrics.count("plan_queries_saved", len(stations) - len(areas))
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+      responses = dict(zip(areas, pool.map(area_request, areas.values())))
+    return [parse_plannen([responses[json.dumps(station.search_area)]]) for station in stations]
+
+  # stations can share probe points (and clusters all of them), every point is queried once
+  queries = list(dict.fromkeys(point for station in stations for point in station.points_around))
+  metrics.count("plan_queries", len(queries))
+  metrics.count("plan_queries_saved", sum(len(station.points_around) for station in stations) - len(queries))
+  with ThreadPoolExecutor(max_workers=workers) as pool:
+    responses = dict(zip(queries, pool.map(lambda q: plan_request(*q), queries)))
+  return [parse_plannen([responses[point] for point in station.points_around]) for station in stations]
@@ -0,0 +1,176 @@
+import argparse
+import json
+import os
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit, parse_qsl
+
+from cache import ResponseCache
+
+
+def fixture_key(method: str, endpoint: str, params=None, body=None) -> str:
+  # query parameters arrive as strings at the server, so record them that way
+  params = {name: str(value) for name, value in (params or {}).items()}
+  return ResponseCache.key(f"{method.upper()} {endpoint}", params, body)
+
+
+class Recorder:
+  """
+  Writes every API response to `directory` as a fixture file, one JSON file
+  per request named after its fixture_key.
+  """
+
+  def __init__(self, directory: str):
+    os.makedirs(directory, exist_ok=True)
+    self.directory = directory
+
+  def record(self, method: str, endpoint: str, params, body, response) -> None:
+    key = fixture_key(method, endpoint, params, body)
+    filename = os.path.join(self.directory, f"{key}.json")
+    fixture = {"method": method.upper(), "endpoint": endpoint, "params": params or {}, "json": body, "response": response}
+    with open(f"{filename}.{threading.get_ident()}.part", "w") as f:
+      json.dump(fixture, f)
+    os.replace(f"{filename}.{threading.get_ident()}.part", filename)
+
+
+def load_fixtures(directory: str) -> dict:
+  """Returns the recorded responses in `directory` by their fixture_key."""
+  fixtures = {}
+  for filename in os.listdir(directory):
+    if filename.endswith(".json"):
+      with open(os.path.join(directory, filename)) as f:
+        fixture = json.load(f)
+      fixtures[fixture_key(fixture["method"], fixture["endpoint"], fixture["params"], fixture["json"])] = fixture["response"]
+  return fixtures
+
+
+class ReplayServer(ThreadingHTTPServer):
+  """
+  Local stand-in for the Ruimtelijke Plannen API that answers from recorded
+  fixtures. Every response is delayed by `latency` seconds (plus up to
+  `jitter`), and a fraction `error_rate` of the requests fails with a 503 or
+  429 carrying a Retry-After of `retry_after` seconds. Requests that were
+  never recorded get a 404.
+
+  To behave like a throttling server, requests beyond `rate_limit` per second
+  get a 429 and requests beyond `max_in_flight` concurrent ones a 503.
+  """
+
+  daemon_threads = True
+
+  def __init__(self, fixtures: dict, port: int = 8765, latency: float = 0, jitter: float = 0, error_rate: float = 0, retry_after: float = 0, rate_limit: float = None, max_in_flight: int = None):
+    super().__init__(("127.0.0.1", port), ReplayHandler)
+    self.fixtures = fixtures
+    self.latency = latency
+    self.jitter = jitter
+    self.error_rate = error_rate
+    self.retry_after = retry_after
+    self.rate_limit = rate_limit
+    self.max_in_flight = max_in_flight
+    self.counts = {"requests": 0, "errors": 0, "misses": 0, "throttled": 0}
+    self.in_flight = 0
+    self._tokens = rate_limit or 0
+    self._updated = time.monotonic()
+    self._lock = threading.Lock()
+
+  def count(self, name: str) -> None:
+    with self._lock:
+      self.counts[name] += 1
+
+  def admit(self):
+    """Starts a request, returns the status to throttle it with or None."""
+    with self._lock:
+      self.in_flight += 1
+      if self.max_in_flight and self.in_flight > self.max_in_flight:
+        return 503
+      if self.rate_limit:
+        now = time.monotonic()
+        self._tokens = min(self.rate_limit, self._tokens + (now - self._updated) * self.rate_limit)
+        self._updated = now
+        if self._tokens < 1:
+          return 429
+        self._tokens -= 1
+    return None
+
+  def done(self):
+    with self._lock:
+      self.in_flight -= 1
+
+
+class ReplayHandler(BaseHTTPRequestHandler):
+  protocol_version = "HTTP/1.1"
+
+  def do_GET(self):
+    self.replay(None)
+
+  def do_POST(self):
+    length = int(self.headers.get("Content-Length", 0))
+    self.replay(json.loads(self.rfile.read(length)) if length else None)
+
+  def replay(self, body):
+    server = self.server
+    server.count("requests")
+    try:
+      throttle = server.admit()
+      time.sleep(server.latency + random.uniform(0, server.jitter))
+      if throttle:
+        server.count("throttled")
+        self.send(throttle, {"title": "too many requests"}, {"Retry-After": str(server.retry_after)})
+      else:
+        self.respond(body)
+    finally:
+      server.done()
+
+  def respond(self, body):
+    server = self.server
+    url = urlsplit(self.path)
+    if random.random() < server.error_rate:
+      server.count("errors")
+      self.send(random.choice([429, 503]), {"title": "injected error"}, {"Retry-After": str(server.retry_after)})
+      return
+    response = server.fixtures.get(fixture_key(self.command, url.path, dict(parse_qsl(url.query)), body))
+    if response is None:
+      server.count("misses")
+      self.send(404, {"title": f"no fixture for {self.command} {self.path}"})
+      return
+    self.send(200, response)
+
+  def send(self, status: int, body, headers=None):
+    payload = json.dumps(body).encode()
+    self.send_response(status)
+    self.send_header("Content-Type", "application/hal+json")
+    self.send_header("Content-Length", str(len(payload)))
+    for name, value in (headers or {}).items():
+      self.send_header(name, value)
+    self.end_headers()
+    self.wfile.write(payload)
+
+  def log_message(self, format, *args):
+    pass
+
+
+if __name__ == "__main__":
+  # Record:  python main.py --record ./fixtures
+  # Replay:  python replay.py ./fixtures --latency 0.05 --error-rate 0.05
+  #          API_URL=http://127.0.0.1:8765 python main.py --no-cache
+  parser = argparse.ArgumentParser(description='Serves recorded API fixtures as a local stand-in for the Ruimtelijke Plannen API')
+  parser.add_argument('fixtures', help="directory written by main.py --record")
+  parser.add_argument('--port', type=int, default=8765, dest="port")
+  parser.add_argument('--latency', type=float, default=0, dest="latency", help="seconds added to every response")
+  parser.add_argument('--jitter', type=float, default=0, dest="jitter", help="up to this many extra seconds, at random")
+  parser.add_argument('--error-rate', type=float, default=0, dest="error_rate", help="fraction of requests answered with a 429 or 503")
+  parser.add_argument('--retry-after', type=float, default=0, dest="retry_after", help="Retry-After sent with the injected errors and throttled requests")
+  parser.add_argument('--rate-limit', type=float, dest="rate_limit", help="answer requests beyond this many per second with a 429")
+  parser.add_argument('--max-in-flight', type=int, dest="max_in_flight", help="answer requests beyond this many at once with a 503")
+  args = parser.parse_args()
+
+  fixtures = load_fixtures(args.fixtures)
+  server = ReplayServer(fixtures, port=args.port, latency=args.latency, jitter=args.jitter, error_rate=args.error_rate, retry_after=args.retry_after, rate_limit=args.rate_limit, max_in_flight=args.max_in_flight)
+  print("> replaying", len(fixtures), "fixtures on", f"http://127.0.0.1:{args.port}")
+  try:
+    server.serve_forever()
+  except KeyboardInterrupt:
+    pass
+  print("> served:", server.counts)
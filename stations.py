@@ -0,0 +1,226 @@
+from dataclasses import dataclass, fields
+
+import numpy as np
+import pandas as pd
+import shapely
+
+import parse_stations
+import vlakken
+
+# a station is identified by its name and netbeheerder
+KEY = ["station", "netbeheerder"]
+
+@dataclass(slots=True, eq=False)
+class Station:
+  """One row of a StationTable, lat and lon are already parsed from geometry."""
+  name: str
+  zip_code: str
+  beschikbare_capaciteit_invoeding_huidig_mva: float
+  beschikbare_capaciteit_afname_huidig_mva: float
+  geometry: str
+  lat: float
+  lon: float
+  points_around: list = None
+  search_area: dict = None
+  cluster: "Station" = None
+  plannen: list = None
+
+# the Station fields that are columns of a StationTable
+COLUMNS = [f.name for f in fields(Station)][:7]
+
+class StationTable:
+  """
+  The stations as columns, with the coordinates parsed once into the NumPy
+  arrays `lat` and `lon`.
+
+  Iterating gives a Station record per row, indexing with an int gives one
+  Station and indexing with a slice or an array of indices gives a
+  StationTable of those rows that shares the records.
+  """
+
+  def __init__(self, columns: dict, records: list = None):
+    self.columns = columns
+    if records is None:
+      records = [Station(*row) for row in zip(*(columns[name].tolist() for name in COLUMNS))]
+    self.records = records
+
+  @classmethod
+  def from_frame(cls, df_stations):
+    lat, lon = parse_stations.parseGeometry(df_stations["geometry"])
+    columns = {
+      "name": df_stations["station"].to_numpy(dtype=object),
+      "zip_code": df_stations["zip_code"].to_numpy(dtype=object),
+      "beschikbare_capaciteit_invoeding_huidig_mva": df_stations["beschikbare_capaciteit_invoeding_huidig_mva"].to_numpy(dtype=float),
+      "beschikbare_capaciteit_afname_huidig_mva": df_stations["beschikbare_capaciteit_afname_huidig_mva"].to_numpy(dtype=float),
+      "geometry": df_stations["geometry"].to_numpy(dtype=object),
+      "lat": lat,
+      "lon": lon,
+    }
+    return cls(columns)
+
+  @property
+  def lat(self) -> np.ndarray:
+    return self.columns["lat"]
+
+  @property
+  def lon(self) -> np.ndarray:
+    return self.columns["lon"]
+
+  def __len__(self):
+    return len(self.records)
+
+  def __iter__(self):
+    return iter(self.records)
+
+  def __getitem__(self, index):
+    if isinstance(index, slice):
+      return StationTable({name: values[index] for name, values in self.columns.items()}, self.records[index])
+    if isinstance(index, np.ndarray):
+      return StationTable({name: values[index] for name, values in self.columns.items()}, [self.records[i] for i in index.tolist()])
+    return self.records[index]
+
+def load_stations(filename: str, only=None) -> StationTable:
+  """
+  Reads the stations from a beschikbare_capaciteit CSV.
+
+  Args:
+    filename: The CSV written by update.update.
+    only: Optional collection of (station, netbeheerder) keys to keep.
+
+  Returns:
+    A StationTable.
+  """
+  usecols = KEY + ["zip_code", "beschikbare_capaciteit_invoeding_huidig_mva", "beschikbare_capaciteit_afname_huidig_mva", "geometry"]
+  df_stations = pd.read_csv(filename, usecols=usecols)
+  if only is not None:
+    df_stations = df_stations[pd.MultiIndex.from_frame(df_stations[KEY]).isin(only)]
+  return StationTable.from_frame(df_stations)
+
+# Radius of the Earth in meters, as in vlakken.calc_distance
+EARTH_RADIUS = 6371 * 1000
+
+PATTERNS = ["cross", "ring", "hex"]
+
+def probe_offsets(pattern: str = "cross", radius: float = 1000, count: int = None) -> np.ndarray:
+  """
+  Returns the (north, east) offsets in meters of the probe points around a
+  station, the station itself first.
+
+  Args:
+    pattern: "cross" for the station and four points north, east, south and west
+      of it, "ring" for `count` (default 8) points on a circle and "hex" for a
+      hexagonal grid with `count` (default 2) rings.
+    radius: The distance in meters to the outermost probes.
+  """
+  if pattern == "cross":
+    offsets = [[0, 0], [radius, 0], [0, radius], [-radius, 0], [0, -radius]]
+  elif pattern == "ring":
+    angles = 2 * np.pi * np.arange(count or 8) / (count or 8)
+    offsets = np.vstack([[0, 0], np.column_stack([np.cos(angles), np.sin(angles)]) * radius])
+  elif pattern == "hex":
+    rings = count or 2
+    q, r = np.meshgrid(np.arange(-rings, rings + 1), np.arange(-rings, rings + 1))
+    q, r = q.ravel(), r.ravel()
+    inside = np.abs(q + r) <= rings
+    q, r = q[inside], r[inside]
+    order = np.argsort(np.maximum.reduce([np.abs(q), np.abs(r), np.abs(q + r)]), kind="stable")
+    spacing = radius / rings
+    offsets = np.column_stack([r * np.sqrt(3) / 2, q + r / 2])[order] * spacing
+  else:
+    raise ValueError(f"unknown probe pattern {pattern!r}, expected one of {PATTERNS}")
+  return np.asarray(offsets, dtype=float)
+
+def offset_coordinates(lat: np.ndarray, lon: np.ndarray, offsets: np.ndarray):
+  """
+  Moves every (lat, lon) by each of the (north, east) `offsets` in meters.
+  Returns two (len(lat), len(offsets)) arrays.
+  """
+  lat, lon = np.asarray(lat, dtype=float), np.asarray(lon, dtype=float)
+  offset_lat = lat[:, None] + np.degrees(offsets[:, 0] / EARTH_RADIUS)
+  offset_lon = lon[:, None] + np.degrees(offsets[:, 1] / EARTH_RADIUS) / np.cos(np.radians(lat))[:, None]
+  return offset_lat, offset_lon
+
+def generate_probes(lat: np.ndarray, lon: np.ndarray, offsets: np.ndarray, snap: float = 1.0):
+  """
+  Places the probe `offsets` around every station and collapses the probes
+  that land within `snap` meters of each other.
+
+  Returns:
+    (probe_lat, probe_lon, index): the unique probe coordinates and a
+    (stations, probes per station) array of indices into them.
+  """
+  probe_lat, probe_lon = offset_coordinates(lat, lon, offsets)
+
+  # probes in the same snap-sized cell are the same probe, the first one is kept
+  step = np.degrees(max(snap, 1e-3) / EARTH_RADIUS)
+  cells = np.round(probe_lat.ravel() / step).astype(np.int64) << 32 | (np.round(probe_lon.ravel() / step).astype(np.int64) & 0xFFFFFFFF)
+  _, first, index = np.unique(cells, return_index=True, return_inverse=True)
+  return probe_lat.ravel()[first], probe_lon.ravel()[first], index.reshape(probe_lat.shape)
+
+def generate_points(stations: StationTable, pattern: str = "cross", radius: float = 1000, count: int = None, snap: float = 1.0) -> StationTable:
+  """
+  Sets `points_around` of every station to the (lat, lon) probe points of
+  `pattern` (see probe_offsets). Probes of different stations that land on
+  the same spot share one point, so it is only queried once.
+  """
+  probe_lat, probe_lon, index = generate_probes(stations.lat, stations.lon, probe_offsets(pattern, radius, count), snap=snap)
+  points = list(zip(probe_lat.tolist(), probe_lon.tolist()))
+  for station, row in zip(stations, index.tolist()):
+    station.points_around = [points[i] for i in row]
+  return stations
+
+SEARCH_SHAPES = ["buffer", "bbox"]
+
+def generate_areas(stations: StationTable, shape: str = "buffer", radius: float = 1000, segments: int = 32) -> StationTable:
+  """
+  Sets `search_area` of every station to a GeoJSON polygon around it: a circle
+  of `radius` meters approximated by `segments` points ("buffer") or the box
+  around that circle ("bbox").
+  """
+  if shape == "buffer":
+    # counterclockwise, as GeoJSON wants exterior rings
+    offsets = probe_offsets("ring", radius, segments)[:0:-1]
+  elif shape == "bbox":
+    offsets = np.array([[-radius, -radius], [-radius, radius], [radius, radius], [radius, -radius]], dtype=float)
+  else:
+    raise ValueError(f"unknown search shape {shape!r}, expected one of {SEARCH_SHAPES}")
+  lats, lons = offset_coordinates(stations.lat, stations.lon, offsets)
+  rings = np.stack([lons, lats], axis=-1).tolist()
+  for station, ring in zip(stations, rings):
+    station.search_area = {"type": "Polygon", "coordinates": [ring + ring[:1]]}
+  return stations
+
+def cluster_stations(stations: StationTable, radius: float = 0) -> np.ndarray:
+  """
+  Groups the stations within `radius` meters of each other, so a cluster can
+  share one plan search. In table order, the first station that isn't in a
+  cluster yet leads a new one with all free stations within `radius` of it.
+  With radius 0 only stations on the same spot are grouped.
+
+  Sets `cluster` of every station to its leader and returns the indices of
+  the leaders.
+  """
+  n = len(stations)
+  if n == 0:
+    return np.arange(0)
+  lat, lon = stations.lat, stations.lon
+  # candidates from an equirectangular projection, checked with the great circle distance
+  y = np.radians(lat) * EARTH_RADIUS
+  x = np.radians(lon) * EARTH_RADIUS * np.cos(np.radians(lat.mean()))
+  points = shapely.points(x, y)
+  left, right = shapely.STRtree(points).query(points, predicate="dwithin", distance=radius * 1.1 + 1)
+  near = vlakken.calc_distance_batch(lon[left], lat[left], lon[right], lat[right]) <= radius
+  left, right = left[near], right[near]
+  order = np.lexsort((right, left))
+  left, right = left[order], right[order]
+  bounds = np.searchsorted(left, np.arange(n + 1))
+
+  leader = np.full(n, -1)
+  for i in range(n):
+    if leader[i] < 0:
+      members = right[bounds[i]:bounds[i + 1]]
+      leader[members[leader[members] < 0]] = i
+      leader[i] = i
+  for station, i in zip(stations, leader.tolist()):
+    station.cluster = stations[i]
+  return np.flatnonzero(leader == np.arange(n))
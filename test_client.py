@@ -0,0 +1,88 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+import client
+import metrics
+import replay
+
+ENDPOINT = "/plannen/NL.IMRO.0000.test/bestemmingsvlakken"
+PARAMS = {"page": "1", "pageSize": "100"}
+RESPONSE = {"_embedded": {"bestemmingsvlakken": [{"id": "vlak"}]}, "_links": {}}
+
+
+@pytest.fixture
+def serve():
+  servers = []
+
+  def start(**kwargs):
+    fixtures = {replay.fixture_key("GET", ENDPOINT, PARAMS): RESPONSE}
+    server = replay.ReplayServer(fixtures, port=0, **kwargs)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    servers.append(server)
+    return server, f"http://127.0.0.1:{server.server_address[1]}{ENDPOINT}"
+
+  yield start
+  for server in servers:
+    server.shutdown()
+    server.server_close()
+
+
+def fetch_all(http: client.Client, url: str, n: int, workers: int, name: str = None) -> list:
+  with ThreadPoolExecutor(max_workers=workers) as pool:
+    return list(pool.map(lambda _: http.request("GET", url, name=name, params=PARAMS), range(n)))
+
+
+def test_limiter_shrinks_under_concurrency_limit(serve):
+  server, url = serve(latency=0.02, max_in_flight=2)
+  limiter = client.AdaptiveLimiter(max_concurrency=8)
+  http = client.Client(pool_size=8, retries=20, backoff=0.01, max_backoff=0.1, limiter=limiter)
+
+  responses = fetch_all(http, url, 80, workers=8)
+
+  assert all(response.status_code == 200 for response in responses)
+  assert all(response.json() == RESPONSE for response in responses)
+  assert server.counts["throttled"] > 0
+  assert limiter.throttled > 0
+  assert limiter.limit < 8
+  assert limiter.in_flight == 0
+
+
+def test_latency_is_recorded_per_attempt(serve):
+  server, url = serve(latency=0.05, max_in_flight=1)
+  http = client.Client(pool_size=4, retries=20, backoff=0.2, max_backoff=0.5, limiter=client.AdaptiveLimiter(max_concurrency=4))
+
+  fetch_all(http, url, 12, workers=4, name="latency_test")
+
+  report = metrics.report()
+  latency = report["latency"]["latency_test"]
+  # one observation per round trip, throttled attempts included
+  assert latency["count"] == server.counts["requests"]
+  # backoff and limiter waits are not part of the round trip
+  assert latency["max_s"] < 0.2
+  assert report["stages"]["retry_backoff"]["wall_s"] > 0
+  assert "limiter_wait" in report["stages"]
+
+
+def test_retry_after_and_rate_limit(serve):
+  server, url = serve(latency=0.01, rate_limit=50, retry_after=0.05)
+  limiter = client.AdaptiveLimiter(max_concurrency=8)
+  http = client.Client(pool_size=8, retries=20, backoff=0.01, max_backoff=1, limiter=limiter)
+
+  responses = fetch_all(http, url, 100, workers=8)
+
+  assert all(response.status_code == 200 for response in responses)
+  assert server.counts["throttled"] > 0
+  assert http.stats()["retries"] == server.counts["throttled"]
+  assert limiter.limit < 8
+
+
+def test_token_bucket_spaces_requests():
+  limiter = client.AdaptiveLimiter(rate=100, burst=1)
+  start = client.time.monotonic()
+  for _ in range(11):
+    limiter.acquire()
+    limiter.release(200, 0.0)
+  # one token up front, the other ten refill at 100 per second
+  assert client.time.monotonic() - start >= 0.09
@@ -0,0 +1,58 @@
+import geopandas as gpd
+import pytest
+import shapely
+
+import geocode
+
+# two neighbouring squares sharing the edge at lon 5.01
+POLYGONS = {
+  "1000AA": shapely.box(5.00, 52.00, 5.01, 52.01),
+  "1000AB": shapely.box(5.01, 52.00, 5.02, 52.01),
+}
+
+
+@pytest.fixture
+def polygons(tmp_path):
+  path = tmp_path / "pc6.gpkg"
+  gpd.GeoDataFrame({"postcode": list(POLYGONS)}, geometry=list(POLYGONS.values()), crs="EPSG:4326").to_file(path)
+  return geocode.LocalGeocoder(str(path))
+
+
+def test_points_inside_polygons(polygons):
+  assert polygons.polygons
+  assert polygons.postcode_many([(52.005, 5.005), (52.005, 5.015), (52.001, 5.019)]) == ["1000AA", "1000AB", "1000AB"]
+
+
+def test_points_on_a_boundary(polygons):
+  # on the outer edge of one polygon, and on the edge both polygons share
+  assert polygons.postcode_many([(52.00, 5.005), (52.01, 5.015)]) == ["1000AA", "1000AB"]
+  assert polygons.postcode(52.005, 5.01) == "1000AA"
+
+
+def test_points_outside_get_the_nearest_polygon(polygons):
+  points = [(52.005, 4.99), (52.005, 5.015), (52.005, 5.03), (51.99, 5.018), (52.005, 5.005)]
+  assert polygons.postcode_many(points) == ["1000AA", "1000AB", "1000AB", "1000AB", "1000AA"]
+
+
+def test_point_dataset(tmp_path):
+  path = tmp_path / "pc6_points.gpkg"
+  # stored in RD New, the geocoder reprojects to lat/lon
+  centers = gpd.GeoSeries([shape.centroid for shape in POLYGONS.values()], crs="EPSG:4326").to_crs(epsg=28992)
+  gpd.GeoDataFrame({"pc6": list(POLYGONS)}, geometry=centers).to_file(path)
+  geocoder = geocode.LocalGeocoder(str(path))
+
+  assert not geocoder.polygons
+  assert geocoder.postcode_many([(52.005, 5.004), (52.009, 5.03), (52.005, 5.0099)]) == ["1000AA", "1000AB", "1000AA"]
+
+
+def test_postcodes_with_a_local_geocoder(polygons):
+  points = [(52.005, 5.0099), (52.005, 5.0101), (52.005, 5.0099)]
+  # unrounded and not cached, rounding to 4 decimals would put both points on the shared edge
+  assert geocode.postcodes(points, polygons, cache_path=None) == ["1000AA", "1000AB", "1000AA"]
+
+
+def test_unknown_postcode_column(tmp_path):
+  path = tmp_path / "other.gpkg"
+  gpd.GeoDataFrame({"name": ["a"]}, geometry=[POLYGONS["1000AA"]], crs="EPSG:4326").to_file(path)
+  with pytest.raises(ValueError, match="no postcode column"):
+    geocode.LocalGeocoder(str(path))
@@ -1,14 +1,143 @@
+import json
+import os
+
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+
 import parse_stations
+import writers
+from stations import KEY
+
+STATIONS_CSV = "./output/beschikbare_capaciteit_elektriciteitsnet.csv"
+STATION_DATA_CSV = "./output/station_data.csv"
+# (station, netbeheerder) keys an incremental update still has to fetch
+PENDING_FILE = "./output/station_data.csv.pending"
+
+CAPACITY_COLUMNS = ["beschikbare_capaciteit_invoeding_huidig_mva", "beschikbare_capaciteit_afname_huidig_mva"]
 
-def update():
+def update(postcode_file: str = None, incremental: bool = False):
   """
   Parameters:
-    None
+    postcode_file: Optional local postcode dataset to geocode the stations offline.
+    incremental: Only geocode stations that were added or moved since the previous
+      run and patch the capacities of the other stations in place.
 
   Returns:
-    None
+    None for a full update. For an incremental update the dict from diff_stations;
+    its "added" and "moved" stations still need their plannen and vlakken fetched.
   """
+  if incremental and os.path.exists(STATIONS_CSV):
+    return update_incremental(postcode_file)
+
   # update de capiciteit CSV file
   print("Getting stations")
-  data = parse_stations.parseStationsGPKG(0, 0)
-  parse_stations.writeStationsToCSV(data, "./output/beschikbare_capaciteit_elektriciteitsnet.csv")
\ No newline at end of file
+  clear_pending()
+  data = parse_stations.parseStationsGPKG(0, 0, postcode_file=postcode_file)
+  parse_stations.writeStationsToCSV(data, STATIONS_CSV)
+
+def update_incremental(postcode_file: str = None) -> dict:
+  """
+  Diffs the new GeoPackage against the previous STATIONS_CSV snapshot and only
+  redoes the work for stations that changed, see update.
+  """
+  print("Getting stations (incremental)")
+  previous = pd.read_csv(STATIONS_CSV, index_col=0)
+  data = parse_stations.parseStationsGPKG(0, 0, with_zip_codes=False)
+  changes = diff_stations(previous, data)
+  print("> stations:", {name: len(keys) for name, keys in changes.items()})
+  # saved before anything is rewritten, so main.py --resume can finish the update
+  save_pending(changes["added"].append(changes["moved"]))
+
+  # stations that didn't move keep their postcode
+  keys = pd.MultiIndex.from_frame(data[KEY])
+  redo = keys.isin(changes["added"]) | keys.isin(changes["moved"])
+  zip_codes = previous.drop_duplicates(KEY).set_index(KEY)["zip_code"]
+  data["zip_code"] = zip_codes.reindex(keys).to_numpy()
+  if redo.any():
+    parse_stations.addZipCodes(data, postcode_file=postcode_file, rows=redo)
+  parse_stations.writeStationsToCSV(data, STATIONS_CSV)
+
+  if os.path.exists(STATION_DATA_CSV):
+    stations = pd.read_csv(STATIONS_CSV, index_col=0)
+    patch_station_data(previous, stations, changes)
+  return changes
+
+def save_pending(keys):
+  with open(PENDING_FILE + ".tmp", "w") as f:
+    json.dump([list(key) for key in keys], f)
+  os.replace(PENDING_FILE + ".tmp", PENDING_FILE)
+
+def load_pending():
+  """Returns the keys saved by the last incremental update, or None when there are none."""
+  if not os.path.exists(PENDING_FILE):
+    return None
+  with open(PENDING_FILE) as f:
+    keys = json.load(f)
+  return pd.MultiIndex.from_tuples([tuple(key) for key in keys], names=KEY) if keys else pd.MultiIndex.from_arrays([[], []], names=KEY)
+
+def clear_pending():
+  if os.path.exists(PENDING_FILE):
+    os.remove(PENDING_FILE)
+
+def diff_stations(previous, data) -> dict:
+  """
+  Compares two station tables by station and netbeheerder.
+
+  Args:
+    previous: The stations of the previous run, as read from STATIONS_CSV.
+    data: The new stations, either read from a CSV or a GeoDataFrame in crs=4326.
+
+  Returns:
+    A dict of (station, netbeheerder) MultiIndexes: "added", "removed", "moved"
+    (different location) and "changed" (same location, different capacity).
+  """
+  previous = _with_coordinates(previous).drop_duplicates(KEY).set_index(KEY)
+  data = _with_coordinates(data).drop_duplicates(KEY).set_index(KEY)
+
+  common = data.index.intersection(previous.index)
+  old, new = previous.loc[common], data.loc[common]
+  moved = ~(np.isclose(old["_a"], new["_a"], rtol=0, atol=1e-9) & np.isclose(old["_b"], new["_b"], rtol=0, atol=1e-9))
+  capacity_changed = ~np.isclose(old[CAPACITY_COLUMNS].to_numpy(dtype=float), new[CAPACITY_COLUMNS].to_numpy(dtype=float), equal_nan=True).all(axis=1)
+  return {
+    "added": data.index.difference(previous.index),
+    "removed": previous.index.difference(data.index),
+    "moved": common[moved],
+    "changed": common[~moved & capacity_changed],
+  }
+
+def patch_station_data(previous, stations, changes: dict):
+  """
+  Brings STATION_DATA_CSV and its extra formats up to date without refetching
+  anything: rows of removed and moved stations are dropped and the capacities
+  of changed stations are replaced. Rows for added and moved stations are
+  appended by main.fillStationsCSV.
+  """
+  station_data = pd.read_csv(STATION_DATA_CSV, index_col=0)
+  row_keys = pd.MultiIndex.from_arrays([station_data["name"], station_data["station_lat"].round(9), station_data["station_long"].round(9)])
+
+  def station_rows(table, keys):
+    # station_data identifies a station by its name and coordinates
+    table = _with_coordinates(table).drop_duplicates(KEY).set_index(KEY).loc[keys]
+    index = pd.MultiIndex.from_arrays([table.index.get_level_values("station"), table["_a"].round(9), table["_b"].round(9)])
+    return pd.DataFrame(table[CAPACITY_COLUMNS].to_numpy(), index=index, columns=CAPACITY_COLUMNS)
+
+  dropped = station_rows(previous, changes["removed"].append(changes["moved"]))
+  keep = ~row_keys.isin(dropped.index)
+
+  capacities = station_rows(stations, changes["changed"])
+  capacities = capacities[~capacities.index.duplicated()]
+  patched = row_keys.isin(capacities.index)
+  station_data.loc[patched, CAPACITY_COLUMNS] = capacities.reindex(row_keys[patched]).to_numpy()
+
+  station_data = station_data[keep].reset_index(drop=True)
+  writers.write_table(station_data, STATION_DATA_CSV)
+  print("> station_data:", (~keep).sum(), "rijen verwijderd,", patched.sum(), "rijen bijgewerkt")
+
+def _with_coordinates(stations):
+  # adds the two coordinates in the order they are written to the CSV ("(a b)")
+  if isinstance(stations, gpd.GeoDataFrame):
+    a, b = stations.geometry.x.to_numpy(), stations.geometry.y.to_numpy()
+  else:
+    a, b = parse_stations.parseGeometry(stations["geometry"])
+  return pd.DataFrame(stations.drop(columns="geometry")).assign(_a=a, _b=b)
@@ -1,32 +1,66 @@
-import requests
+import os
 import geopandas as gpd
+import numpy as np
+import shapely
 from shapely.geometry import Polygon
 from math import radians, cos, sin, asin, sqrt
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from multiprocessing import shared_memory
 
+import api
 
-def get_vlakken(planID: str) -> list:
+
+def iter_vlakken(planID: str) -> api.Pages:
   headers = {
     'accept': 'application/hal+json',
     'Accept-Crs': 'epsg:4258',
-    'X-Api-Key': 'l7ceb5f23326474774b0de37248b34ed0c',
+    'X-Api-Key': os.getenv('API_KEY'),
   }
 
   params = {
-    'page': '1',
-    'pageSize': '10',
     'bestemmingshoofdgroep': 'bedrijf',
     'expand': 'geometrie',
   }
 
-  response = requests.get(
-    f'https://ruimte.omgevingswet.overheid.nl/ruimtelijke-plannen/api/opvragen/v4/plannen/{planID}/bestemmingsvlakken',
+  return api.Pages(
+    'GET',
+    f'/plannen/{planID}/bestemmingsvlakken',
+    'bestemmingsvlakken',
     params=params,
     headers=headers,
+    name='get_vlakken',
   )
 
-  result = response.json()
+def get_vlakken(planID: str) -> list:
+  return list(iter_vlakken(planID))
+
+def get_vlakken_for_plans(planIDs, workers=8, transform=None) -> dict:
+  """
+  Fetches the vlakken of every plan exactly once, with at most `workers`
+  plans in flight.
 
-  return result["_embedded"]["bestemmingsvlakken"]
+  Args:
+    planIDs: An iterable of plan ids, duplicates are fetched only once.
+    workers: The maximum number of concurrent requests.
+    transform: Optional function applied to every vlak as its page arrives,
+      only what it returns is kept (e.g. exterior_ring), so the full pages
+      of a plan are never held at once.
+
+  Returns:
+    A dict mapping each plan id to a (vlakken, pages) tuple, where pages is
+    the api.Pages that fetched them.
+  """
+  planIDs = list(dict.fromkeys(planIDs))
+
+  def fetch(planID):
+    pages = iter_vlakken(planID)
+    if transform is None:
+      return list(pages), pages
+    return [transform(vlak) for vlak in pages], pages
+
+  with ThreadPoolExecutor(max_workers=workers) as pool:
+    return dict(zip(planIDs, pool.map(fetch, planIDs)))
 
 def calc_area_and_centoid(coordinates) -> tuple:
   polygon = gpd.GeoSeries([Polygon(coordinates)], crs='EPSG:4258') # type: ignore
@@ -35,6 +69,115 @@ def calc_area_and_centoid(coordinates) -> tuple:
   area = polygon.area[0]
   return (area, centoid)
 
+def exterior_ring(vlak):
+  """Returns the exterior ring of a vlak's geometry, or None when it has none."""
+  try:
+    return vlak["geometrie"]["coordinates"][0]
+  except (KeyError, IndexError, TypeError):
+    return None
+
+def pack_rings(rings) -> tuple:
+  """
+  Validates exterior rings and packs the valid ones into one flat array.
+
+  Args:
+    rings: A sequence of exterior rings ([[lon, lat], ...]), entries that are
+      None or not a valid ring are left out.
+
+  Returns:
+    A tuple (valid, coords, offsets): the indices of the valid rings, an (m, 2)
+    array with all their coordinates and the start of every ring in it (plus
+    the end of the last one).
+  """
+  valid, coords = [], []
+  for i, ring in enumerate(rings):
+    try:
+      ring = np.asarray(ring, dtype=float)
+    except (TypeError, ValueError):
+      continue
+    if ring.ndim != 2 or ring.shape[1] < 2:
+      continue
+    closed = len(ring) > 0 and (ring[0, :2] == ring[-1, :2]).all()
+    if len(ring) < (4 if closed else 3):
+      continue
+    valid.append(i)
+    coords.append(ring[:, :2])
+  offsets = np.concatenate([[0], np.cumsum([len(ring) for ring in coords], dtype=np.int64)])
+  coords = np.concatenate(coords) if coords else np.empty((0, 2))
+  return np.array(valid, dtype=np.int64), coords, offsets
+
+def calc_area_and_centroid_packed(coords, offsets) -> tuple:
+  """calc_area_and_centroid_batch for rings packed by pack_rings, all of them valid."""
+  indices = np.repeat(np.arange(len(offsets) - 1), np.diff(offsets))
+  polygons = shapely.polygons(shapely.linearrings(coords, indices=indices))
+  centroids = shapely.centroid(polygons)
+  areas = gpd.GeoSeries(polygons, crs='EPSG:4258').to_crs({'proj':'cea'}).area.to_numpy()
+  return areas, shapely.get_x(centroids), shapely.get_y(centroids)
+
+def calc_area_and_centroid_batch(rings, pool=None, workers: int = 1, min_chunk_size: int = 64) -> tuple:
+  """
+  Vectorized version of calc_area_and_centoid for many polygons at once.
+
+  Builds all polygons with shapely's array functions and reprojects them
+  with a single to_crs call. With a process `pool` the polygons are split in
+  `workers` chunks (of at least `min_chunk_size` polygons) that are computed
+  in parallel, see _calc_area_and_centroid_shared.
+
+  Args:
+    rings: A sequence of exterior rings ([[lon, lat], ...]). Entries that are
+      None or not a valid ring get NaN as area and centroid.
+    pool: Optional concurrent.futures.ProcessPoolExecutor, see process_pool.
+    workers: The number of processes in `pool`.
+
+  Returns:
+    A tuple (areas, centroid_x, centroid_y) of numpy arrays, areas in m2.
+  """
+  areas = np.full(len(rings), np.nan)
+  centroid_x = np.full(len(rings), np.nan)
+  centroid_y = np.full(len(rings), np.nan)
+
+  valid, coords, offsets = pack_rings(rings)
+  if not len(valid):
+    return areas, centroid_x, centroid_y
+
+  chunk_size = max(min_chunk_size, -(-len(valid) // max(workers, 1)))
+  if pool is None or len(valid) <= chunk_size:
+    results = [calc_area_and_centroid_packed(coords, offsets)]
+  else:
+    # the workers read the coordinates from shared memory instead of getting them pickled
+    shm = shared_memory.SharedMemory(create=True, size=coords.nbytes)
+    try:
+      np.ndarray(coords.shape, dtype=np.float64, buffer=shm.buf)[:] = coords
+      chunks = [offsets[start:start + chunk_size + 1] for start in range(0, len(valid), chunk_size)]
+      results = list(pool.map(_calc_area_and_centroid_shared, [shm.name] * len(chunks), [coords.shape] * len(chunks), chunks))
+    finally:
+      shm.close()
+      shm.unlink()
+
+  areas[valid], centroid_x[valid], centroid_y[valid] = (np.concatenate(column) for column in zip(*results))
+  return areas, centroid_x, centroid_y
+
+def process_pool(workers: int):
+  """
+  Returns a ProcessPoolExecutor with `workers` processes for
+  calc_area_and_centroid_batch, or None when workers <= 1 or the platform
+  can't fork.
+  """
+  if workers is None or workers <= 1 or "fork" not in multiprocessing.get_all_start_methods():
+    return None
+  # forked workers don't import main.py (and run its command line) again
+  return ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("fork"))
+
+def _calc_area_and_centroid_shared(name: str, shape: tuple, offsets) -> tuple:
+  # runs in a worker process, on the rings between offsets[0] and offsets[-1]
+  # of the coordinates in shared memory block `name`
+  shm = shared_memory.SharedMemory(name=name)
+  try:
+    coords = np.ndarray(shape, dtype=np.float64, buffer=shm.buf)[offsets[0]:offsets[-1]].copy()
+  finally:
+    shm.close()
+  return calc_area_and_centroid_packed(coords, offsets - offsets[0])
+
 
 def calc_distance(lon1, lat1, lon2, lat2):
     """
@@ -52,6 +195,31 @@ def calc_distance(lon1, lat1, lon2, lat2):
     r = 6371  # Radius of the Earth in kilometers
     return c * r * 1000
 
+def calc_distance_batch(lon1, lat1, lon2, lat2):
+    """
+    Vectorized calc_distance: the great circle distance in meters between
+    arrays of points (specified in decimal degrees). The arguments are
+    broadcast against each other, so a single station can be compared
+    with an array of vlakken.
+    """
+    lon1, lat1, lon2, lat2 = (np.radians(np.asarray(x, dtype=float)) for x in (lon1, lat1, lon2, lat2))
+
+    dlon = lon2 - lon1
+    dlat = lat2 - lat1
+    a = np.sin(dlat/2)**2 + np.cos(lat1) * np.cos(lat2) * np.sin(dlon/2)**2
+    c = 2 * np.arcsin(np.sqrt(a))
+    r = 6371  # Radius of the Earth in kilometers
+    return c * r * 1000
+
+def distance_matrix(station_lons, station_lats, vlak_lons, vlak_lats):
+    """
+    Returns the (stations x vlakken) matrix of distances in meters.
+    """
+    return calc_distance_batch(
+      np.asarray(station_lons, dtype=float)[:, None], np.asarray(station_lats, dtype=float)[:, None],
+      np.asarray(vlak_lons, dtype=float)[None, :], np.asarray(vlak_lats, dtype=float)[None, :],
+    )
+
 polygon = {
          "type":"Polygon",
          "coordinates":[
@@ -0,0 +1,153 @@
+import json
+import os
+
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+import shapely
+
+# Extra formats written next to every CSV, see configure
+FORMATS = ()
+
+EXTENSIONS = {
+  "parquet": ".parquet",
+  "arrow": ".arrow",
+}
+
+
+def configure(formats=()):
+  """
+  Sets the formats written alongside the CSV files: "parquet" (GeoParquet
+  for station layers) and/or "arrow" (Arrow IPC). Both need pyarrow.
+  """
+  global FORMATS
+  unknown = set(formats) - set(EXTENSIONS)
+  if unknown:
+    raise ValueError(f"unknown output formats: {sorted(unknown)}")
+  FORMATS = tuple(formats)
+
+
+def write_table(data, filename: str):
+  """
+  Writes `data` to `filename` as CSV and in the configured extra formats to
+  the same path with their own extension.
+  """
+  write_csv(data, filename)
+  write_extra_formats(data, filename)
+
+
+def write_extra_formats(data, filename: str):
+  base, _ = os.path.splitext(filename)
+  for fmt in FORMATS:
+    WRITERS[fmt](data, base + EXTENSIONS[fmt])
+
+
+class RowWriter:
+  """
+  Appends rows to a CSV in batches, so a long run only keeps one batch in
+  memory and a crash loses at most the rows of the unfinished batch.
+
+  After every flush the number of completed stations, rows and the file size
+  are saved to `<filename>.progress`. With resume=True the CSV is truncated
+  back to that state and `stations_done` tells the caller where to continue.
+  With append=True rows are added to an existing CSV instead of a new one.
+  close() writes the configured extra formats and removes the progress file.
+  """
+
+  def __init__(self, filename: str, columns: list, batch_size: int = 1000, resume: bool = False, append: bool = False):
+    self.filename = filename
+    self.columns = columns
+    self.batch_size = batch_size
+    self.progress_file = filename + ".progress"
+    self.stations_done = 0
+    self.rows = 0
+    self._batch = []
+    self._pending_rows = 0
+    self._pending_stations = 0
+
+    if resume and os.path.exists(self.progress_file):
+      with open(self.progress_file) as f:
+        progress = json.load(f)
+      with open(filename, "r+b") as f:
+        f.truncate(progress["size"])
+      self.stations_done = progress["stations_done"]
+      self.rows = progress["rows"]
+      print("> resuming", filename, "after", self.stations_done, "stations")
+    elif append and os.path.exists(filename):
+      self.rows = len(pd.read_csv(filename, usecols=[0]))
+    else:
+      pd.DataFrame(columns=columns).to_csv(filename)
+    self._save_progress()
+
+  def write(self, rows):
+    """Adds the rows (a dict of columns or a DataFrame) of one station."""
+    rows = pd.DataFrame(rows, columns=self.columns)
+    self._batch.append(rows)
+    self._pending_rows += len(rows)
+
+  def station_done(self):
+    """Marks the station whose rows were written last as complete."""
+    self._pending_stations += 1
+    if self._pending_rows >= self.batch_size:
+      self.flush()
+
+  def flush(self):
+    if self._batch:
+      rows = pd.concat(self._batch, ignore_index=True)
+      rows.index += self.rows
+      rows.to_csv(self.filename, mode="a", header=False)
+      self.rows += len(rows)
+    self.stations_done += self._pending_stations
+    self._batch = []
+    self._pending_rows = 0
+    self._pending_stations = 0
+    self._save_progress()
+
+  def close(self):
+    self.flush()
+    os.remove(self.progress_file)
+    if FORMATS:
+      write_extra_formats(pd.read_csv(self.filename, index_col=0), self.filename)
+
+  def _save_progress(self):
+    progress = {"stations_done": self.stations_done, "rows": self.rows, "size": os.path.getsize(self.filename)}
+    with open(self.progress_file + ".tmp", "w") as f:
+      json.dump(progress, f)
+    os.replace(self.progress_file + ".tmp", self.progress_file)
+
+
+def write_csv(data, filename: str):
+  if isinstance(data, gpd.GeoDataFrame):
+    # points are written as "(x y)" instead of "POINT (x y)"
+    wkt = pd.Series(shapely.to_wkt(np.asarray(data.geometry), rounding_precision=-1), index=data.index, dtype=object)
+    data = pd.DataFrame(data).assign(**{data.geometry.name: wkt.str.replace("POINT ", "", regex=False)})
+  data.to_csv(filename)
+
+
+def write_parquet(data, filename: str):
+  _require_pyarrow()
+  # GeoDataFrames are written as GeoParquet, keeping the geometry typed
+  data.to_parquet(filename)
+
+
+def write_arrow(data, filename: str):
+  _require_pyarrow()
+  import pyarrow as pa
+  import pyarrow.feather as feather
+
+  if isinstance(data, gpd.GeoDataFrame):
+    data = pd.DataFrame(data).assign(**{data.geometry.name: data.geometry.to_wkb()})
+  feather.write_feather(pa.Table.from_pandas(data), filename)
+
+
+def _require_pyarrow():
+  try:
+    import pyarrow  # noqa: F401
+  except ImportError:
+    raise ImportError("writing parquet or arrow output needs pyarrow: pip install pyarrow") from None
+
+
+WRITERS = {
+  "parquet": write_parquet,
+  "arrow": write_arrow,
+}